@@ -6,37 +6,66 @@ It includes utilities for compressing directories, generating file names,
 and exporting single or multiple images based on user-defined regions of interest.
 """
 
-import hashlib
-import random
-import string
+import secrets
 import shutil
-import contextlib
-import io
+import tarfile
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
+import numpy as np
+import zstandard
 import ee
 import geemap
-from shapely.geometry import box, Polygon
-from region_similarity.helpers import message
+import shapely
+from shapely.geometry import shape
+from region_similarity.helpers import ee_gate, flash, get_info, message
 from solara.lab import task
 
 
-def compress_dir(dir_path, target_dir, delete=True):
+def compress_dir(dir_path, target_dir, delete=True, archive_format="zst"):
     """
-    Compress a directory into a zip file.
+    Compress a directory into a Zstandard-compressed tarball or a zip file.
 
     Args:
         dir_path (Path): Path to the directory to be compressed.
-        target_dir (Path): Path to the directory where the zip file will be saved.
+        target_dir (Path): Path to the directory where the archive will be saved.
         delete (bool, optional): Whether to delete the original directory after compression. Defaults to True.
+        archive_format (str, optional): `"zst"` for a `.tar.zst` archive or `"zip"` for a zip file. Defaults to `"zst"`.
 
     Returns:
-        Path: Path to the created zip file.
+        Path: Path to the created archive.
     """
-    zip_path = target_dir / dir_path.name
-    shutil.make_archive(zip_path, "zip", dir_path)
+    files = (path for path in dir_path.rglob("*") if path.is_file())
+
+    # Write the files straight into the archive, deleting each one once it is added
+    if archive_format == "zip":
+        archive_path = target_dir / f"{dir_path.name}.zip"
+
+        # GeoTIFFs barely compress with DEFLATE, so use a fast level
+        with zipfile.ZipFile(
+            archive_path, "w", zipfile.ZIP_DEFLATED, compresslevel=1
+        ) as zf:
+            for path in files:
+                zf.write(path, path.relative_to(dir_path))
+                if delete:
+                    path.unlink()
+    else:
+        archive_path = target_dir / f"{dir_path.name}.tar.zst"
+
+        # Stream a tarball through a multi-threaded Zstandard compressor
+        cctx = zstandard.ZstdCompressor(level=3, threads=-1)
+        with open(archive_path, "wb") as raw, cctx.stream_writer(
+            raw
+        ) as zw, tarfile.open(fileobj=zw, mode="w|") as tf:
+            for path in files:
+                tf.add(path, arcname=str(path.relative_to(dir_path)))
+                if delete:
+                    path.unlink()
+
+    # Remove the remaining empty directories
     if delete:
-        shutil.rmtree(dir_path)
-    return zip_path
+        shutil.rmtree(dir_path, ignore_errors=True)
+    return archive_path
 
 
 def generate_random_hash(length=16):
@@ -44,21 +73,16 @@ def generate_random_hash(length=16):
     Generate a random hash string.
 
     Args:
-        length (int, optional): Length of the random string to generate. Defaults to 16.
+        length (int, optional): Number of hexadecimal characters to generate. Defaults to 16.
 
     Returns:
         str: A random hash string.
     """
-    random_string = "".join(
-        random.choices(string.ascii_letters + string.digits, k=length)
-    )
-    hash_object = hashlib.sha256(random_string.encode())
-    random_hash = hash_object.hexdigest()
-    return random_hash
+    return secrets.token_hex(length // 2)
 
 
 @task
-def export_single_image(img, roi, resolution, m):
+def export_single_image(img, roi, resolution, m, job_dir=None, mode="url"):
     """
     Export a single Earth Engine image to a download URL.
 
@@ -67,6 +91,9 @@ def export_single_image(img, roi, resolution, m):
         roi (ee.Geometry): Region of interest to clip and export the image.
         resolution (float): Spatial resolution of the exported image in meters.
         m: Object containing message and URL information for status updates.
+        job_dir (Path, optional): Directory to save the exported image in `local` mode. Defaults to None.
+        mode (str, optional): `"url"` to link to Earth Engine directly or `"local"` to download
+            the image with geemap and link to a compressed archive. Defaults to `"url"`.
 
     The function attempts to generate a download URL for the image and displays
     status messages through the provided messaging object. If successful, it shows
@@ -75,76 +102,279 @@ def export_single_image(img, roi, resolution, m):
     message(m, f"Generating download URL...", False)
 
     try:
-        url = img.getDownloadURL(
+        if mode == "local":
+            download_image(img, roi, resolution, job_dir / "image.tif")
+            archive = compress_dir(job_dir, public_dir())
+            url = f"{m.url}/static/public/{archive.name}"
+        else:
+            url = get_download_url(img, roi, resolution)
+
+        message(m, f"Generating download URL...", True)
+        flash(m, f"Download link: {url}", duration=10)
+
+    except Exception as e:
+        flash(m, f"Error generating download URL: {e}", duration=5)
+
+
+def public_dir():
+    """
+    Get the directory whose files are served under `/static/public`, creating it if needed.
+
+    Returns:
+        Path: Path to the public directory.
+    """
+    path = Path("../public")
+    path.mkdir(exist_ok=True)
+    return path
+
+
+def get_download_url(img, region, resolution):
+    """
+    Generate a download URL for a region of an Earth Engine image.
+
+    Args:
+        img (ee.Image): Earth Engine image to export.
+        region (ee.Geometry): Region of the image to export.
+        resolution (float): Spatial resolution of the exported image in meters.
+
+    Returns:
+        str: The download URL.
+    """
+    with ee_gate:
+        return img.getDownloadURL(
             {
                 "scale": resolution,
-                "region": roi,
+                "region": region,
                 "format": "GEO_TIFF",
                 "filePerBand": False,
             }
         )
 
-        message(m, f"Generating download URL...", True)
-        message(m, f"Download link: {url}", False)
-        message(m, f"Download link: {url}", True, duration=10)
 
-    except Exception as e:
-        message(m, f"Error generating download URL: {e}", False)
-        message(m, f"Error generating download URL: {e}", True, duration=5)
+def download_image(img, region, resolution, filename):
+    """
+    Download a region of an Earth Engine image to a local GeoTIFF file with geemap.
+
+    Args:
+        img (ee.Image): Earth Engine image to export.
+        region (ee.Geometry): Region of the image to export.
+        resolution (float): Spatial resolution of the exported image in meters.
+        filename (Path): Path of the GeoTIFF file to write.
+
+    Returns:
+        Path: Path of the written GeoTIFF file.
+
+    Raises:
+        RuntimeError: If the image could not be downloaded.
+    """
+    # geemap requests its own download URL, so it goes through the gate as well. It
+    # reports its errors instead of raising them, so check that the file exists.
+    with ee_gate:
+        geemap.ee_export_image(
+            img,
+            filename=str(filename),
+            scale=resolution,
+            region=region,
+            file_per_band=False,
+            verbose=False,
+        )
+    if not Path(filename).is_file():
+        raise RuntimeError(f"Failed to download {Path(filename).name}")
+    return filename
 
 
 @task
-def export_multiple_images(cells, job_dir, img, resolution, m):
+def export_multiple_images(
+    cells, job_dir, img, resolution, m, max_workers=16, mode="url"
+):
     """
     Export multiple Earth Engine images to download URLs.
 
+    The cells are exported concurrently since each export is bound by the
+    Earth Engine round-trip rather than by local computation.
+
     Args:
         cells (list): List of Earth Engine geometries representing image cells.
-        job_dir (Path): Directory to save the exported images (unused).
+        job_dir (Path): Directory to save the exported images in `local` mode.
         img (ee.Image): Earth Engine image to export.
         resolution (float): Spatial resolution of the exported images in meters.
         m: Object containing message, URL, and progress bar information.
+        max_workers (int, optional): Number of concurrent exports. Defaults to 16.
+        mode (str, optional): `"url"` to list Earth Engine download URLs or `"local"` to download
+            the cells with geemap and link to a compressed archive. Defaults to `"url"`.
     """
     message(m, f"Generating download URLs...", False)
-    urls = []
-    for idx, cell in enumerate(cells):
-        try:
-            urls.append(
-                img.clip(cell).getDownloadURL(
-                    {
-                        "scale": resolution,
-                        "region": cell,
-                        "format": "GEO_TIFF",
-                        "filePerBand": False,
-                    }
-                )
-            )
-        except Exception as ex:
-            message(m, f"Error generating URL for cell {idx+1}: {ex}", False)
-            message(m, f"Error generating URL for cell {idx+1}: {ex}", True, 5)
-
-    # Save URLs to a file
-    random_hash = generate_random_hash()
-    url_file = Path("../public") / f"urls_{random_hash}.txt"
-    url_file.parent.mkdir(exist_ok=True)
-    url_file.write_text("\n".join(urls))
-
-    # Share the URL file location
+
+    # Show the progress bar
+    m.download_bar.value = 0
+    m.download_bar.max = len(cells)
+    m.download_bar.layout.visibility = "visible"
+    m.download_bar.layout.height = "auto"
+
+    # Export the cells concurrently while keeping the results in cell order
+    results = [None] * len(cells)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        if mode == "local":
+            futures = {
+                executor.submit(
+                    download_image,
+                    img,
+                    cell,
+                    resolution,
+                    job_dir / f"cell_{idx + 1}.tif",
+                ): idx
+                for idx, cell in enumerate(cells)
+            }
+        else:
+            futures = {
+                executor.submit(get_download_url, img, cell, resolution): idx
+                for idx, cell in enumerate(cells)
+            }
+        for future in as_completed(futures):
+            idx = futures[future]
+            try:
+                results[idx] = future.result()
+            except Exception as ex:
+                flash(m, f"Error exporting cell {idx+1}: {ex}", 5)
+            m.download_bar.value += 1
+
+    # Hide the progress bar
+    m.download_bar.layout.visibility = "hidden"
+    m.download_bar.layout.height = "0px"
+
+    if mode == "local":
+        # Compress the downloaded cells into a single archive
+        archive = compress_dir(job_dir, public_dir())
+        text = f"Download link: {m.url}/static/public/{archive.name}"
+    else:
+        # Save URLs to a file
+        random_hash = generate_random_hash()
+        url_file = public_dir() / f"urls_{random_hash}.txt"
+        url_file.write_text("\n".join(url for url in results if url))
+        text = f"Download URLs available at: {m.url}/static/public/{url_file.name}"
+
+    # Share the download location
     message(m, f"Generating download URLs...", True)
-    message(
-        m,
-        f"Download URLs available at: {m.url}/static/public/urls_{random_hash}.txt",
-        False,
-    )
-    message(
-        m,
-        f"Download URLs available at: {m.url}/static/public/urls_{random_hash}.txt",
-        True,
-        duration=10,
+    flash(m, text, duration=10)
+
+
+def get_qr_bounds(m):
+    """
+    Get the bounding box coordinates of the query region.
+
+    The coordinates are cached on the map object and only requested from
+    Earth Engine again when the query region changes.
+
+    Args:
+        m: Map object containing the query region.
+
+    Returns:
+        tuple: The `(x_min, y_min, x_max, y_max)` bounds of the query region.
+    """
+    key = m.qr.serialize()
+    if m.caches.qr_bounds is None or m.caches.qr_bounds[0] != key:
+        # Only fetch the outer ring; Earth Engine returns it counter-clockwise
+        # from the lower-left corner, so vertices 0 and 2 are opposite corners
+        ring = get_info(m.qr.bounds().coordinates().get(0))
+        (x_min, y_min), (x_max, y_max) = ring[0], ring[2]
+        m.caches.qr_bounds = (key, (x_min, y_min, x_max, y_max))
+    return m.caches.qr_bounds[1]
+
+
+def get_qr_geometry(m):
+    """
+    Get the query region as a shapely geometry.
+
+    The geometry is built from the coordinates kept when the query region was set, and
+    only requested from Earth Engine if they are not known locally.
+
+    Args:
+        m: Map object containing the query region.
+
+    Returns:
+        shapely.geometry.base.BaseGeometry: The query region.
+    """
+    if m.qr_coords is None:
+        return shape(get_info(m.qr))
+
+    # Multipolygon coordinates are nested one level deeper than polygon coordinates
+    is_multi = isinstance(m.qr_coords[0][0][0], (list, tuple))
+    geom_type = "MultiPolygon" if is_multi else "Polygon"
+    return shape({"type": geom_type, "coordinates": m.qr_coords})
+
+
+def split_geometry(qr_geom, x_min, y_min, x_cells, y_cells, cell_size):
+    """
+    Split the bounding box of a region into square cells that intersect the region.
+
+    Args:
+        qr_geom (shapely.geometry.Polygon): Region to cover with cells.
+        x_min (float): Minimum longitude of the bounding box.
+        y_min (float): Minimum latitude of the bounding box.
+        x_cells (int): Number of cells along the longitude axis.
+        y_cells (int): Number of cells along the latitude axis.
+        cell_size (float): Size of a cell in degrees.
+
+    Returns:
+        list: Earth Engine rectangles of the cells intersecting the region.
+    """
+    # Build the bounds of all the cells at once, column by column
+    x0, y0 = np.meshgrid(
+        x_min + np.arange(x_cells) * cell_size,
+        y_min + np.arange(y_cells) * cell_size,
+        indexing="ij",
     )
+    bounds = np.stack([x0, y0, x0 + cell_size, y0 + cell_size], axis=-1).reshape(-1, 4)
+
+    # Keep the cells that intersect the ROI. The tree only runs the exact test on cells whose envelope overlaps the ROI.
+    geoms = shapely.box(bounds[:, 0], bounds[:, 1], bounds[:, 2], bounds[:, 3])
+    tree = shapely.STRtree(geoms)
+    hits = np.sort(tree.query(qr_geom, predicate="intersects"))
+
+    # Convert the shapely rectangles to Earth Engine geometries
+    return [ee.Geometry.Rectangle(b.tolist()) for b in bounds[hits]]
+
+
+def get_covering_cells(m, cell_size):
+    """
+    Get the square cells covering the query region.
+
+    The grid is computed server-side with `ee.Geometry.coveringGrid`, which only
+    returns the cells touching the query region. If that fails, the cells are
+    computed locally from the bounding box of the query region.
+
+    Args:
+        m: Map object containing the query region.
+        cell_size (float): Size of a cell in meters.
+
+    Returns:
+        list: Earth Engine geometries of the cells covering the query region.
+    """
+    try:
+        grid = m.qr.coveringGrid(ee.Projection("EPSG:4326").atScale(cell_size))
+        return [ee.Geometry(f["geometry"]) for f in get_info(grid)["features"]]
+    except (AttributeError, ee.EEException):
+        pass
+
+    # Convert the cell size from meters to degrees
+    meters_per_degree = 111320  # Approximation at the equator
+    cell_size = cell_size / meters_per_degree
+
+    # Get the bounding box of the ROI
+    x_min, y_min, x_max, y_max = get_qr_bounds(m)
+
+    # Use the region itself, so the cells of its bounding box outside of it are dropped
+    qr_geom = get_qr_geometry(m)
+
+    # Calculate the number of cells needed
+    x_cells = int((x_max - x_min) / cell_size) + 1
+    y_cells = int((y_max - y_min) / cell_size) + 1
+
+    # Split the geometry into cells
+    return split_geometry(qr_geom, x_min, y_min, x_cells, y_cells, cell_size)
 
 
-def export_image(e, m):
+def export_image(e, m, mode="url", resolution=100):
     """
     Export an image from Google Earth Engine to a local directory.
 
@@ -158,6 +388,9 @@ def export_image(e, m):
     Args:
         e: Earth Engine object.
         m: Map object containing user inputs and map elements.
+        mode (str, optional): `"url"` to share Earth Engine download URLs or `"local"` to
+            download the images with geemap and share a compressed archive. Defaults to `"url"`.
+        resolution (float, optional): Spatial resolution of the exported images in meters. Defaults to 100.
 
     Returns:
         None
@@ -169,7 +402,7 @@ def export_image(e, m):
         tmp = Path.home() / "tmp"
         tmp.mkdir(exist_ok=True)
 
-        # Generate a random hash text for the job using hashlib
+        # Generate a random hash text for the job
         job_dir = tmp / generate_random_hash()
         job_dir.mkdir(exist_ok=True)
 
@@ -182,62 +415,16 @@ def export_image(e, m):
         # Stack the features and the result
         img = ee.Image.cat([features, result]).reproject(crs='EPSG:4326', scale=1000)
 
-        # Set the image resolution in meters
-        resolution = 100
-
-        # Convert the image resolution from meters to degrees
-        meters_per_degree = 111320  # Approximation at the equator
-        cell_size = 1000 * resolution / meters_per_degree
-
-        # Get the bounding box of the ROI
-        coords = m.qr.bounds().getInfo()["coordinates"][0]
-        x_coords = [coord[0] for coord in coords]
-        y_coords = [coord[1] for coord in coords]
-        x_min, x_max = min(x_coords), max(x_coords)
-        y_min, y_max = min(y_coords), max(y_coords)
-
-        # Create a shapely polygon from `x_coords` and `y_coords`
-        qr_geom = Polygon(zip(x_coords, y_coords))
-
-        # Calculate the number of cells needed
-        x_cells = int((x_max - x_min) / cell_size) + 1
-        y_cells = int((y_max - y_min) / cell_size) + 1
-
-        def split_geometry(x_cells, y_cells):
-            cells = []
-            for i in range(x_cells):
-                for j in range(y_cells):
-
-                    # if the cell does not intersect the ROI, continue
-                    if not box(
-                        x_min + i * cell_size,
-                        y_min + j * cell_size,
-                        x_min + (i + 1) * cell_size,
-                        y_min + (j + 1) * cell_size,
-                    ).intersects(qr_geom):
-                        continue
-
-                    # Convert the shapely rectangle to an Earth Engine geometry
-                    cell = ee.Geometry.Rectangle(
-                        [
-                            x_min + i * cell_size,
-                            y_min + j * cell_size,
-                            x_min + (i + 1) * cell_size,
-                            y_min + (j + 1) * cell_size,
-                        ]
-                    )
-                    cells.append(cell)
-            return cells
+        # Get the cells covering the ROI, each spanning 1000 pixels
+        cells = get_covering_cells(m, 1000 * resolution)
 
         # Export the image directly if only one cell is needed
-        if x_cells <= 1 and y_cells <= 1:
-            export_single_image(img, m.qr, resolution, m)
+        if len(cells) <= 1:
+            export_single_image(img, m.qr, resolution, m, job_dir, mode)
             return
 
-        # Split the geometry and export each cell
-        cells = split_geometry(x_cells, y_cells)
-        export_multiple_images(cells, job_dir, img, resolution, m)
+        # Export each cell
+        export_multiple_images(cells, job_dir, img, resolution, m, mode=mode)
 
     except Exception as e:
-        message(m, f"Error: {e}", False)
-        message(m, f"Error: {e}", True, 5)
+        flash(m, f"Error: {e}", 5)
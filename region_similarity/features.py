@@ -7,10 +7,59 @@ It uses Earth Engine (ee) for geospatial operations and ipywidgets for UI compon
 
 import ee
 import ipywidgets as widgets
-from region_similarity.helpers import message
-from solara import display
+from concurrent.futures import TimeoutError
+from region_similarity.helpers import (
+    flash,
+    get_info,
+    get_qr_roi,
+    message,
+    run_with_timeout,
+)
 from solara.lab import task
-from multiprocess import Pool
+
+
+def on_remove_feature_click(button):
+    """
+    Handle a click on the remove button of a feature row.
+
+    The feature name and the map are read from the attributes set by `feature_row`.
+
+    Args:
+        button (widgets.Button): The clicked remove button.
+
+    Returns:
+        None
+    """
+    remove_feature(button.feature, button.m)
+
+
+def feature_row(name, expression, m):
+    """
+    Build the row displaying a feature along with its remove button.
+
+    Args:
+        name (str): The name of the feature.
+        expression (str): The expression of the feature.
+        m (object): The map object containing layers and features.
+
+    Returns:
+        widgets.HBox: The row widget.
+    """
+    remove_button = widgets.Button(
+        description="x",
+        layout=widgets.Layout(width="20px", text_align="center", padding="0"),
+    )
+    spacer = widgets.HBox([], layout=widgets.Layout(flex="1 1 auto"))
+    remove_button.feature, remove_button.m = name, m
+    remove_button.on_click(on_remove_feature_click)
+    return widgets.HBox(
+        [
+            widgets.Label(f"{name}:{expression}\n"),
+            spacer,
+            remove_button,
+        ],
+        layout=widgets.Layout(width="100%"),
+    )
 
 
 def remove_feature(feature, m):
@@ -27,26 +76,32 @@ def remove_feature(feature, m):
     # Drop the feature from the features dictionary
     del m.features[feature]
 
-    # Clear the output widget and print the added features
-    with m.added_features_output:
-        m.added_features_output.clear_output()
-        for name, (expression, _) in m.features.items():
-            remove_button = widgets.Button(
-                description="x",
-                layout=widgets.Layout(width="20px", text_align="center", padding="0"),
-            )
-            spacer = widgets.HBox([], layout=widgets.Layout(flex="1 1 auto"))
-            remove_button.on_click(lambda _, a=name: remove_feature(a, m))
-            display(
-                widgets.HBox(
-                    [
-                        widgets.Label(f"{name}:{expression}\n"),
-                        spacer,
-                        remove_button,
-                    ],
-                    layout=widgets.Layout(width="100%"),
-                )
-            )
+    # Remove the feature's row from the added features
+    row = m.feature_rows.pop(feature)
+    m.added_features_output.children = tuple(
+        child for child in m.added_features_output.children if child is not row
+    )
+    row.close()
+
+
+def get_alias_stack(m):
+    """
+    Get the image stacking all the aliases along with a band selector per alias.
+
+    The stack is cached on the map object and rebuilt only when the aliases change.
+
+    Args:
+        m (object): The map object containing the aliases.
+
+    Returns:
+        tuple: The stacked `ee.Image` and a dictionary mapping each alias to its band.
+    """
+    key = tuple((alias, id(img)) for alias, (_, _, _, _, _, img) in m.aliases.items())
+    if m.caches.alias_stack is None or m.caches.alias_stack[0] != key:
+        image = ee.Image.cat([img for _, (_, _, _, _, _, img) in m.aliases.items()])
+        selectors = {k: image.select(k) for k in m.aliases.keys()}
+        m.caches.alias_stack = (key, image, selectors)
+    return m.caches.alias_stack[1], m.caches.alias_stack[2]
 
 
 def run_check_feature_img(feature_img):
@@ -60,7 +115,7 @@ def run_check_feature_img(feature_img):
         bool: True if the image is computable, False otherwise.
     """
     try:
-        _ = feature_img.getInfo()
+        _ = get_info(feature_img)
         return True
     except Exception as e:
         return False
@@ -71,6 +126,8 @@ def async_add_feature(ds, alias, m, timeout_seconds=10, attempts=3):
     """
     Asynchronously add a feature to the map with retry logic.
 
+    A feature that still cannot be computed after the last attempt is removed again.
+
     Args:
         ds (ee.Image): The Earth Engine image to add.
         alias (str): The name of the feature.
@@ -81,16 +138,12 @@ def async_add_feature(ds, alias, m, timeout_seconds=10, attempts=3):
     # Add a message
     message(m, f"[Background task] Loading `{alias}`...", False)
 
-    pool = Pool(processes=1)  # Create a single process pool
-
     for attempt in range(attempts):
         try:
 
-            # Start the process asynchronously using apply_async
-            result = pool.apply_async(run_check_feature_img, (ds,))
-
-            # Get the result with a timeout. This will raise a TimeoutError if it exceeds the timeout.
-            result.get(timeout=timeout_seconds)
+            # Check the image with a timeout. This will raise a TimeoutError if it exceeds the timeout.
+            if not run_with_timeout(run_check_feature_img, (ds,), timeout_seconds):
+                raise ValueError(f"`{alias}` is not computable.")
 
             # Visualization task
             viz = {
@@ -116,23 +169,28 @@ def async_add_feature(ds, alias, m, timeout_seconds=10, attempts=3):
         except Exception as e:
 
             # We got a failure, it's simple to just say that it failed and move on to the next attempt.
-            message(m, f"Attempt {attempt + 1} failed. Retrying...", False)
-            message(m, f"Attempt {attempt + 1} failed. Retrying...", True, 1)
+            flash(m, f"Attempt {attempt + 1} failed. Retrying...", 1)
 
             # If it's the last attempt, we will not retry
             if attempt == attempts - 1:
                 message(m, f"[Background task] Loading `{alias}`...", True, 0.1)
-                message(m, f"Consider a lower resolution.", False)
-                message(m, f"Consider a lower resolution.", True, 1)
+
+                # Drop the feature so it does not break the searches, unless it was
+                # redefined or removed in the meantime
+                if alias in m.features and m.features[alias][1] is ds:
+                    remove_feature(alias, m)
+
+                if isinstance(e, TimeoutError):
+                    error = "It timed out, consider a lower resolution."
+                else:
+                    error = f"Error: {e}."
+                flash(m, f"Removed `{alias}`. {error}", 10)
                 return
 
             else:
                 # If it's not the last attempt, we will retry
                 continue
 
-    pool.close()  # Close the pool
-    pool.join()  # Ensure all processes have finished
-
 
 def add_feature(e, m, udf_text=None):
     """
@@ -154,20 +212,12 @@ def add_feature(e, m, udf_text=None):
 
     # If the UDF is empty, we will not add it
     if not udf:
-        message(m, "Please enter a UDF.", False)
-        message(m, "Please enter a UDF.", True)
+        flash(m, "Please enter a UDF.")
         return
 
     if ":" not in udf:
-        message(
-            m,
-            "Please enter a valid UDF expression. Template: `{name}:{expression}`.",
-            False,
-        )
-        message(
-            m,
-            "Please enter a valid UDF expression. Template: `{name}:{expression}`.",
-            True,
+        flash(
+            m, "Please enter a valid UDF expression. Template: `{name}:{expression}`."
         )
         return
 
@@ -177,77 +227,54 @@ def add_feature(e, m, udf_text=None):
     try:
 
         # Crop the image to the query region + reference region
-        qr_roi = m.qr if not m.roi else m.qr.union(m.roi)
-
-        # Stack all the bands into a single image
-        image = ee.Image.cat([img for _, (_, _, _, _, _, img) in m.aliases.items()])
+        qr_roi = get_qr_roi(m)
 
         # If the expression is equal to any of the aliases, we will use the alias
         if expression in m.aliases:
             feature_img = m.aliases[expression][-1]
         else:
-            feature_img = image.expression(
-                expression, {k: image.select(k) for k in m.aliases.keys()}
-            ).select(0)
+            # Stack all the bands into a single image
+            image, selectors = get_alias_stack(m)
+            feature_img = image.expression(expression, selectors).select(0)
 
-        # Calculate the mean and standard deviation
-        mean = feature_img.reduceRegion(
-            reducer=ee.Reducer.mean(),
-            geometry=qr_roi,
-            scale=100,
-            maxPixels=1e3,
-            bestEffort=True,
-            tileScale=2,
-        )
-        stdDev = feature_img.reduceRegion(
-            reducer=ee.Reducer.stdDev(),
+        # Name the band after the feature so that its band names are known without querying the server
+        feature_img = feature_img.rename(name)
+        band_names = [name]
+
+        # Calculate the mean and standard deviation in a single pass
+        stats = feature_img.reduceRegion(
+            reducer=ee.Reducer.mean().combine(ee.Reducer.stdDev(), sharedInputs=True),
             geometry=qr_roi,
             scale=100,
             maxPixels=1e3,
             bestEffort=True,
             tileScale=2,
         )
+        mean = ee.List([stats.get(f"{b}_mean") for b in band_names])
+        stdDev = ee.List([stats.get(f"{b}_stdDev") for b in band_names])
 
-        # Verify that the image is computable by calculating the mean. Use a try-except block to stop early if not.
-        try:
-            mean.values().getInfo()
-        except Exception as e:
-            message(m, f"Error: {e}.", False)
-            message(m, f"Error: {e}.", True)
-            return
-
-        # Standardize the feature values using lazy evaluation
-        mean_image = ee.Image.constant(mean.values())
-        stdDev_image = ee.Image.constant(stdDev.values())
+        # Standardize the feature values using lazy evaluation. Errors surface when `async_add_feature` computes the image.
+        mean_image = ee.Image.constant(mean)
+        stdDev_image = ee.Image.constant(stdDev)
 
         # Standardize the feature values
         feature_img = feature_img.subtract(mean_image).divide(stdDev_image)
 
         # Add the feature
-        m.features[name] = [expression, feature_img]
-
-        # Clear the output widget and print the added variables
-        with m.added_features_output:
-            m.added_features_output.clear_output()
-            for name, (expression, _) in m.features.items():
-                remove_button = widgets.Button(
-                    description="x",
-                    layout=widgets.Layout(
-                        width="20px", text_align="center", padding="0"
-                    ),
-                )
-                spacer = widgets.HBox([], layout=widgets.Layout(flex="1 1 auto"))
-                remove_button.on_click(lambda _, a=name: remove_feature(a, m))
-                display(
-                    widgets.HBox(
-                        [
-                            widgets.Label(f"{name}:{expression}\n"),
-                            spacer,
-                            remove_button,
-                        ],
-                        layout=widgets.Layout(width="100%"),
-                    )
-                )
+        m.features[name] = [expression, feature_img, band_names]
+
+        # Display the feature, replacing its previous row if it is being redefined
+        row = feature_row(name, expression, m)
+        previous_row = m.feature_rows.get(name)
+        if previous_row is None:
+            m.added_features_output.children += (row,)
+        else:
+            m.added_features_output.children = tuple(
+                row if child is previous_row else child
+                for child in m.added_features_output.children
+            )
+            previous_row.close()
+        m.feature_rows[name] = row
 
         # Empty out the expression field
         m.udf.value = ""
@@ -255,5 +282,4 @@ def add_feature(e, m, udf_text=None):
         async_add_feature(feature_img, name, m)
 
     except Exception as e:
-        message(m, f"Error: {e}.", False)
-        message(m, f"Error: {e}.", True, 10)
+        flash(m, f"Error: {e}.", 10)
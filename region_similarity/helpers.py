@@ -7,7 +7,63 @@ and updating map visualizations based on thresholds.
 """
 
 import ee
-import time
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+# Guards the outputs of the output widgets, which are mutated from the timer threads
+output_lock = threading.Lock()
+
+# Bounds the number of concurrent blocking requests to Earth Engine
+ee_gate = threading.BoundedSemaphore(8)
+
+# Thread pool shared by the alias builds and the feature checks. They wait on Earth Engine,
+# so threads avoid forking a process per task, and are sized to the Earth Engine gate.
+executor = ThreadPoolExecutor(max_workers=8)
+
+
+class MapCaches:
+    """
+    Values derived from the state of a map, dropped together when the map is reset.
+
+    Attributes:
+        search (dict): Earth Engine objects of the search by key, in LRU order.
+        alias_stack (tuple): The key, stacked image and selectors of the aliases.
+        qr_bounds (tuple): The key and bounds of the query region.
+        qr_roi (tuple): The query region, the reference region and their union.
+    """
+
+    __slots__ = ("search", "alias_stack", "qr_bounds", "qr_roi")
+
+    def __init__(self):
+        self.search = {}
+        self.alias_stack = None
+        self.qr_bounds = None
+        self.qr_roi = None
+
+
+def schedule_clear(widget, text, duration):
+    """
+    Removes a message from an output widget after a delay, without blocking the caller.
+
+    Args:
+        widget (ipywidgets.Output): The output widget displaying the message.
+        text (str): The message to remove.
+        duration (float): The duration in seconds to wait before removing the message.
+
+    Returns:
+        None
+    """
+
+    def clear():
+        with output_lock:
+            widget.outputs = tuple(
+                [e for e in widget.outputs if e["text"] != f"{text}\n"]
+            )
+
+    timer = threading.Timer(duration, clear)
+    timer.daemon = True
+    timer.start()
 
 
 def message(m, text="", clear=True, duration=3):
@@ -23,16 +79,142 @@ def message(m, text="", clear=True, duration=3):
     Returns:
         None
     """
-    with m.output_widget:
-        if clear:
-            time.sleep(duration)
-            m.output_widget.outputs = tuple(
-                [e for e in m.output_widget.outputs if e["text"] != f"{text}\n"]
-            )
-        elif text:
+    if clear:
+        schedule_clear(m.output_widget, text, duration)
+    elif text:
+        with output_lock, m.output_widget:
             m.output_widget.append_stdout(f"{text}\n")
 
 
+def flash(m, text, duration=3):
+    """
+    Displays a message in the output widget of the map object and clears it after a delay.
+
+    Args:
+        m (object): Map object containing the output widget.
+        text (str): The message to display.
+        duration (int): The duration in seconds to wait before clearing the message.
+
+    Returns:
+        None
+    """
+    with output_lock, m.output_widget:
+        m.output_widget.append_stdout(f"{text}\n")
+    schedule_clear(m.output_widget, text, duration)
+
+
+def debounce(wait):
+    """
+    Delays calls to the decorated callback until no new call has arrived for `wait` seconds.
+
+    Only the last call of a burst is executed, with its own arguments. Bursts are tracked
+    per map object, which is expected as the last positional argument of the callback.
+
+    Args:
+        wait (float): The quiet period in seconds before the callback is executed.
+
+    Returns:
+        Callable: The decorator.
+    """
+
+    def decorator(fn):
+        timers = dict()
+        lock = threading.Lock()
+
+        @functools.wraps(fn)
+        def wrapper(*args):
+            key = id(args[-1])
+
+            def run():
+                # Drop the entry so the timer does not keep the map alive, unless a
+                # newer call has replaced it in the meantime
+                with lock:
+                    if timers.get(key) is not timer:
+                        return
+                    del timers[key]
+                fn(*args)
+
+            timer = threading.Timer(wait, run)
+            timer.daemon = True
+            with lock:
+                if key in timers:
+                    timers[key].cancel()
+                timers[key] = timer
+            timer.start()
+
+        return wrapper
+
+    return decorator
+
+
+def get_info(object):
+    """
+    Fetches the value of an Earth Engine object, waiting for a free request slot first.
+
+    Args:
+        object (ee.ComputedObject): The Earth Engine object to evaluate.
+
+    Returns:
+        object: The evaluated value of the object.
+    """
+    with ee_gate:
+        return object.getInfo()
+
+
+def run_with_timeout(fn, args, timeout_seconds):
+    """
+    Run a function on the shared thread pool and raise if it does not return in time.
+
+    The timeout starts when the function starts, so the time spent waiting for a free
+    worker of the shared pool is not counted against it.
+
+    Args:
+        fn (callable): The function to run.
+        args (tuple): The positional arguments to pass to the function.
+        timeout_seconds (float): The timeout in seconds.
+
+    Returns:
+        The value returned by the function.
+
+    Raises:
+        TimeoutError: If the function does not return within the timeout.
+    """
+    started = threading.Event()
+
+    def run():
+        started.set()
+        return fn(*args)
+
+    future = executor.submit(run)
+    started.wait()
+    try:
+        return future.result(timeout=timeout_seconds)
+    except TimeoutError:
+        # Cancel the call so it is not awaited. Earth Engine cannot be interrupted, so a
+        # call that is already waiting on it still holds its worker until it answers.
+        future.cancel()
+        raise
+
+
+def get_qr_roi(m):
+    """
+    Get the union of the query region and the reference region.
+
+    The union is cached on the map object and only rebuilt when either region is replaced.
+
+    Args:
+        m (object): Map object containing the query and reference regions.
+
+    Returns:
+        ee.Geometry: The query region, merged with the reference region if one is set.
+    """
+    cached = m.caches.qr_roi
+    if cached is None or cached[0] is not m.qr or cached[1] is not m.roi:
+        union = m.qr if not m.roi else m.qr.union(m.roi)
+        m.caches.qr_roi = cached = (m.qr, m.roi, union)
+    return cached[2]
+
+
 def is_valid_gee_object(m, object):
     """
     Checks if a given Google Earth Engine (GEE) object is valid by performing light sanity checks based on object type.
@@ -50,65 +232,60 @@ def is_valid_gee_object(m, object):
     """
     if isinstance(object, ee.ImageCollection):
         # Check if the ImageCollection contains more than 1 image
-        count = object.size().getInfo()
+        count = get_info(object.size())
         if count > 0:
             return True
         else:
-            message(m, "Error: ImageCollection contains no images.", False)
-            message(m, "Error: ImageCollection contains no images.", True, 5)
+            flash(m, "Error: ImageCollection contains no images.", 5)
             return False
 
     if isinstance(object, ee.Image):
         # Check if the image has bands
-        bands = object.bandNames().getInfo()
+        bands = get_info(object.bandNames())
         if bands:
             return True
         else:
-            message(m, "Image has no bands.", False)
-            message(m, "Image has no bands.", True, 5)
+            flash(m, "Image has no bands.", 5)
             return False
 
     elif isinstance(object, ee.Geometry):
         # Check if the geometry area is more than 0
-        area = object.area().getInfo()
+        area = get_info(object.area())
         if area > 0:
             return True
         else:
-            message(m, "Error: Geometry area is 0.", False)
-            message(m, "Error: Geometry area is 0.", True, 5)
+            flash(m, "Error: Geometry area is 0.", 5)
             return False
 
     elif isinstance(object, ee.FeatureCollection):
         # Check if the FeatureCollection contains more than 1 feature
-        count = object.size().getInfo()
+        count = get_info(object.size())
         if count > 0:
             return True
         else:
-            message(m, "Error: FeatureCollection contains no features.", False)
-            message(m, "Error: FeatureCollection contains no features.", True, 5)
+            flash(m, "Error: FeatureCollection contains no features.", 5)
             return False
 
     elif isinstance(object, ee.Feature):
         # Check if the feature has valid geometry
-        area = object.geometry().area().getInfo()
+        area = get_info(object.geometry().area())
         if area > 0:
             return True
         else:
-            message(m, "Error: Feature has invalid geometry.", False)
-            message(m, "Error: Feature has invalid geometry.", True, 5)
+            flash(m, "Error: Feature has invalid geometry.", 5)
             return False
 
     else:
         # For other types, use a generic check
         try:
-            _ = object.getInfo()
+            _ = get_info(object)
             return True
         except ee.EEException as e:
-            message(m, f"Error: {e}", False)
-            message(m, f"Error: {e}", True, 5)
+            flash(m, f"Error: {e}", 5)
             return False
 
 
+@debounce(0.15)
 def update_map(change, m):
     """
     Updates the map visualization by applying a threshold to the average distance image.
@@ -126,6 +303,8 @@ def update_map(change, m):
 
     Note:
         This function assumes that m.average_distance is a valid ee.Image object.
+        Calls are debounced, so only the last threshold of a burst of slider
+        changes adds a layer.
     """
     max_val = change.new
 
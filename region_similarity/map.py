@@ -6,8 +6,13 @@ in a region similarity analysis application. It includes functions for updating
 dropdowns, handling clustering changes, and resetting the map.
 """
 
+import re
+from contextlib import ExitStack
 from datetime import date
-from region_similarity.helpers import message
+from region_similarity.helpers import MapCaches, flash
+
+# Names of the base map layers that are kept when the map is reset
+BASEMAP_PATTERN = re.compile(r"OpenStreetMap")
 
 
 def update_distance_dropdown(change, m):
@@ -24,8 +29,7 @@ def update_distance_dropdown(change, m):
     try:
         m.distance_fun = change["new"]
     except Exception as e:
-        message(m, f"Error: {e}", False)
-        message(m, f"Error: {e}", True, 5)
+        flash(m, f"Error: {e}", 5)
 
 
 def update_mask_dropdown(change, m):
@@ -42,8 +46,7 @@ def update_mask_dropdown(change, m):
     try:
         m.mask = change["new"]
     except Exception as e:
-        message(m, f"Error: {e}", False)
-        message(m, f"Error: {e}", True, 5)
+        flash(m, f"Error: {e}", 5)
 
 
 def handle_clustering_change(change, m):
@@ -74,8 +77,7 @@ def handle_clustering_change(change, m):
             m.max_value_slider.disabled = False
             m.num_clusters.disabled = True
     except Exception as e:
-        message(m, f"Error: {e}", False)
-        message(m, f"Error: {e}", True, 5)
+        flash(m, f"Error: {e}", 5)
 
 
 def reset_map(e, m):
@@ -92,56 +94,90 @@ def reset_map(e, m):
     """
     try:
 
-        # Reset the layers
-        m.layers = [layer for layer in m.layers if "OpenStreetMap" in layer.name]
-
-        # Clear the output of the added variables widget
-        with m.added_variables_output:
-            m.added_variables_output.clear_output()
-
-        # Clear the output of the main output widget
-        with m.added_features_output:
-            m.added_features_output.clear_output()
-
-        # Clear the messaging output
-        with m.output_widget:
-            m.output_widget.clear_output()
-
-        # Reset various attributes of the map object
-        m.level = 0
-        m.qr_set = False
-        m.roi_set = False
-        m.qr = None
-        m.roi = None
-        m.distances = None
-        m.average_distance = None
-        m.roi_upload_button.value = tuple()
-        m.ros_upload_button.value = tuple()
-        m.band_dropdown.value = None
-        m.band_dropdown.options = list()
-        m.mask_dropdown.value = "All"
-        update_mask_dropdown({"new": "All"}, m)
-        m.distance_dropdown.value = "Euclidean"
-        update_distance_dropdown({"new": "Euclidean"}, m)
-        m.custom_product_input.value = ""
-        m.agg_fun_dropdown.value = "LAST"
-        m.layer_alias_input.value = ""
-        m.udf.value = ""
-        m.aliases = dict()
-        m.features = dict()
-        handle_clustering_change({"new": False}, m)
-        m.cluster_checkbox.value = False
-        m.set_region_button.disabled = False
-        m.start_date.value = date(2000, 1, 1)
-        m.end_date.value = date(2000, 1, 1)
-        m.start = date(2000, 1, 1)
-        m.end = date(2000, 1, 1)
-        m.max_value_slider.value = 3.3
-        m.download_bar.value = 0
-        m.download_bar.layout.visibility = "hidden"
-        m.download_bar.layout.height = "0px"
-        m.spec_import_button.value = tuple()
+        # Hold the syncs of the widgets reset below, so each sends a single update
+        held = (
+            m,
+            m.roi_upload_button,
+            m.ros_upload_button,
+            m.band_dropdown,
+            m.mask_dropdown,
+            m.distance_dropdown,
+            m.custom_product_input,
+            m.agg_fun_dropdown,
+            m.layer_alias_input,
+            m.udf,
+            m.search_button,
+            m.set_roi_button,
+            m.num_clusters,
+            m.cluster_checkbox,
+            m.set_region_button,
+            m.start_date,
+            m.end_date,
+            m.max_value_slider,
+            m.download_bar,
+            m.download_bar.layout,
+            m.spec_import_button,
+        )
+        with ExitStack() as stack:
+            for widget in held:
+                stack.enter_context(widget.hold_sync())
+
+            # Reset the layers, only syncing them if any layer is removed
+            layers = tuple(
+                layer for layer in m.layers if BASEMAP_PATTERN.search(layer.name)
+            )
+            if len(layers) != len(m.layers):
+                m.layers = layers
+
+            # Clear the added variables
+            m.added_variables_output.children = tuple()
+
+            # Clear the added features
+            m.added_features_output.children = tuple()
+
+            # Clear the messaging output
+            with m.output_widget:
+                m.output_widget.clear_output()
+
+            # Reset various attributes of the map object
+            m.level = 0
+            m.qr_set = False
+            m.roi_set = False
+            m.qr = None
+            m.qr_coords = None
+            m.roi = None
+            m.roi_coords = None
+            m.distances = None
+            m.average_distance = None
+            m.roi_upload_button.value = tuple()
+            m.ros_upload_button.value = tuple()
+            m.band_dropdown.value = None
+            m.band_dropdown.options = list()
+            m.mask_dropdown.value = "All"
+            update_mask_dropdown({"new": "All"}, m)
+            m.distance_dropdown.value = "Euclidean"
+            update_distance_dropdown({"new": "Euclidean"}, m)
+            m.custom_product_input.value = ""
+            m.agg_fun_dropdown.value = "LAST"
+            m.layer_alias_input.value = ""
+            m.udf.value = ""
+            m.aliases = dict()
+            m.alias_rows = dict()
+            m.features = dict()
+            m.feature_rows = dict()
+            m.caches = MapCaches()
+            handle_clustering_change({"new": False}, m)
+            m.cluster_checkbox.value = False
+            m.set_region_button.disabled = False
+            m.start_date.value = date(2000, 1, 1)
+            m.end_date.value = date(2000, 1, 1)
+            m.start = date(2000, 1, 1)
+            m.end = date(2000, 1, 1)
+            m.max_value_slider.value = 3.3
+            m.download_bar.value = 0
+            m.download_bar.layout.visibility = "hidden"
+            m.download_bar.layout.height = "0px"
+            m.spec_import_button.value = tuple()
 
     except Exception as e:
-        message(m, f"Error resetting map: {e}", False)
-        message(m, f"Error resetting map: {e}", True, 5)
+        flash(m, f"Error resetting map: {e}", 5)
@@ -5,7 +5,7 @@ This module contains functions for updating the start and end dates of a period
 It provides error handling and user feedback through message displays.
 """
 
-from region_similarity.helpers import message
+from region_similarity.helpers import flash
 
 
 def update_start_date(change, m):
@@ -27,8 +27,7 @@ def update_start_date(change, m):
     try:
         m.start = change["new"]
     except Exception as e:
-        message(m, f"Error: {e}", False)
-        message(m, f"Error: {e}", True, 5)
+        flash(m, f"Error: {e}", 5)
 
 
 def update_end_date(change, m):
@@ -50,5 +49,4 @@ def update_end_date(change, m):
     try:
         m.end = change["new"]
     except Exception as e:
-        message(m, f"Error: {e}", False)
-        message(m, f"Error: {e}", True, 5)
+        flash(m, f"Error: {e}", 5)
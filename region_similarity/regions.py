@@ -9,12 +9,134 @@ and handles the visualization of these regions on the map.
 
 from pathlib import Path
 from io import BytesIO
+from importlib.util import find_spec
+import atexit
 import ee
+import json
+import shutil
 import tempfile
+import threading
 import zipfile
-import geopandas as gpd
-from shapely.geometry import shape, mapping
-from region_similarity.helpers import message
+import shapely
+from shapely.geometry import MultiPolygon, Polygon, mapping
+from region_similarity.helpers import flash
+
+# Pyogrio reads files in bulk instead of record by record like fiona
+READ_ENGINE = "pyogrio" if find_spec("pyogrio") else "fiona"
+
+# Parent directory of the extracted uploads, created on the first upload
+upload_dir = None
+upload_dir_lock = threading.Lock()
+
+# Tolerance in degrees (about 10 m at the equator) used to simplify the regions
+SIMPLIFY_TOLERANCE = 1e-4
+
+# Number of vertices above which a region is reported as too detailed
+MAX_VERTICES = 50_000
+
+
+def simplify_geometry(m, geom):
+    """
+    Simplifies a region geometry before it is sent to Earth Engine.
+
+    Every reduction and sample over a region carries its full geometry, so vertices finer
+    than the analysis scale only inflate the requests.
+
+    Args:
+        m (object): Map object for displaying messages.
+        geom (shapely.geometry.base.BaseGeometry): The region geometry.
+
+    Returns:
+        shapely.geometry.base.BaseGeometry: The simplified geometry.
+    """
+    simplified = geom.simplify(SIMPLIFY_TOLERANCE, preserve_topology=True)
+
+    # Warn about regions that remain too detailed after simplification
+    vertices = shapely.get_num_coordinates(simplified)
+    if vertices > MAX_VERTICES:
+        flash(
+            m, f"Warning: The region has {vertices} vertices, requests may be slow.", 5
+        )
+
+    return simplified
+
+
+def geometry_coordinates(geom):
+    """
+    Gets the GeoJSON coordinates of a geometry as nested lists.
+
+    The coordinates are kept on the map next to the Earth Engine region, so they do not
+    have to be requested back from Earth Engine.
+
+    Args:
+        geom (shapely.geometry.base.BaseGeometry): The region geometry.
+
+    Returns:
+        list: The GeoJSON coordinates of the geometry.
+    """
+    return json.loads(shapely.to_geojson(geom))["coordinates"]
+
+
+def get_upload_dir():
+    """
+    Gets the parent directory of the extracted uploads, creating it on first use.
+
+    The directory is shared by all the uploads of the process and removed at exit.
+
+    Returns:
+        str: Path to the upload directory.
+    """
+    global upload_dir
+    with upload_dir_lock:
+        if upload_dir is None:
+            upload_dir = tempfile.mkdtemp(prefix="uploads-")
+            atexit.register(shutil.rmtree, upload_dir, ignore_errors=True)
+    return upload_dir
+
+
+def read_uploaded_geometry(m, uploaded_file):
+    """
+    Reads an uploaded region file into a single simplified geometry.
+
+    Only the first shapefile of zip archives is extracted in a temporary directory and read,
+    any other format is inferred by geopandas from the file content.
+
+    Args:
+        m (object): Map object for displaying messages.
+        uploaded_file (dict): Uploaded file, with its `name` and `content`.
+
+    Returns:
+        shapely.geometry.base.BaseGeometry: The merged geometry of the file features.
+
+    Raises:
+        ValueError: If the uploaded archive does not contain a shapefile.
+    """
+    import geopandas as gpd
+
+    file_content = uploaded_file["content"]
+    file_name = uploaded_file["name"]
+
+    # Extract the files of the first *.shp file in a temporary directory and read it
+    if file_name.endswith(".zip"):
+        with tempfile.TemporaryDirectory(dir=get_upload_dir()) as tmpdir:
+            with zipfile.ZipFile(BytesIO(file_content), "r") as zip_ref:
+                names = zip_ref.namelist()
+                shp_files = [name for name in names if name.endswith(".shp")]
+                if not shp_files:
+                    raise ValueError("No shapefile found in the archive.")
+
+                # Skip the members that are not sidecars of the shapefile
+                stem = shp_files[0].rpartition(".")[0]
+                members = [name for name in names if name.rpartition(".")[0] == stem]
+                zip_ref.extractall(tmpdir, members=members)
+                gdf = gpd.read_file(Path(tmpdir) / shp_files[0], engine=READ_ENGINE)
+    else:
+        # Geopandas can infer the format based on the file extension
+        gdf = gpd.read_file(BytesIO(file_content), engine=READ_ENGINE)
+
+    # Merge the features into a single geometry, unless there is only one
+    geom = gdf.geometry.iloc[0] if len(gdf) == 1 else gdf.union_all()
+    return simplify_geometry(m, geom)
 
 
 def set_region_of_interest(e, m):
@@ -34,12 +156,12 @@ def set_region_of_interest(e, m):
     Raises:
         Exception: If there's an error setting the search region.
     """
+    import geopandas as gpd
 
     try:
 
         if len(m.draw_control.data) == 0:
-            message(m, "Please draw a reference region on the map.", False)
-            message(m, "Please draw a reference region on the map.", True)
+            flash(m, "Please draw a reference region on the map.")
             return
 
         # Get all drawn geometries
@@ -50,10 +172,13 @@ def set_region_of_interest(e, m):
         ]
 
         # Convert to a multipolygon geometry with shapely
-        roi_geom = shape({"type": "MultiPolygon", "coordinates": geoms})
+        roi_geom = simplify_geometry(
+            m, MultiPolygon([Polygon(rings[0], rings[1:]) for rings in geoms])
+        )
 
         # Set the actual search region as a ee object
         m.roi = ee.Geometry(mapping(roi_geom))
+        m.roi_coords = geometry_coordinates(roi_geom)
 
         # Add the new ROI as a GeoDataFrame to the map
         m.add_gdf(
@@ -78,8 +203,7 @@ def set_region_of_interest(e, m):
         m.roi_set = True
 
     except Exception as e:
-        message(m, f"Error setting search region: {e}", False)
-        message(m, f"Error setting search region: {e}", True, 5)
+        flash(m, f"Error setting search region: {e}", 5)
 
 
 def handle_roi_upload_change(change, m):
@@ -99,33 +223,20 @@ def handle_roi_upload_change(change, m):
     Raises:
         Exception: If there's an error setting the reference region.
     """
+    import geopandas as gpd
+
     try:
         # Get the uploaded file from the ROS upload button
         uploaded_file = m.roi_upload_button.value
 
         if uploaded_file:
-            file_content = uploaded_file[0]["content"]
-            file_name = uploaded_file[0]["name"]
-
-            # Extract the files in a temporary directory and read the first *.shp file
-            if file_name.endswith(".zip"):
-                with tempfile.TemporaryDirectory() as tmpdir:
-                    with zipfile.ZipFile(BytesIO(file_content), "r") as zip_ref:
-                        zip_ref.extractall(tmpdir)
-                        shp_files = [f for f in Path(tmpdir).rglob("*.shp")]
-                        if shp_files:
-                            gdf = gpd.read_file(shp_files[0])
-            else:
-                # Geopandas can infer the format based on the file extension
-                gdf = gpd.read_file(BytesIO(file_content))
-
-            m.roi = ee.Geometry(mapping(gdf.unary_union))
+            geom = read_uploaded_geometry(m, uploaded_file[0])
+            m.roi = ee.Geometry(mapping(geom))
+            m.roi_coords = geometry_coordinates(geom)
 
             # Add the new query region as a GeoDataFrame to the map
             m.add_gdf(
-                gpd.GeoDataFrame(
-                    geometry=gpd.GeoSeries([gdf.unary_union]), crs="EPSG:4326"
-                ),
+                gpd.GeoDataFrame(geometry=[geom], crs="EPSG:4326"),
                 "Reference Region",
                 style={
                     "color": "green",
@@ -142,8 +253,7 @@ def handle_roi_upload_change(change, m):
             m.roi_set = True
 
     except Exception as e:
-        message(m, f"Error setting reference region: {e}", False)
-        message(m, f"Error setting reference region: {e}", True, 5)
+        flash(m, f"Error setting reference region: {e}", 5)
 
 
 def set_search_region(e, m):
@@ -163,12 +273,12 @@ def set_search_region(e, m):
     Raises:
         Exception: If there's an error setting the search region.
     """
+    import geopandas as gpd
 
     try:
 
         if len(m.draw_control.data) == 0:
-            message(m, "Please draw a reference region on the map.", False)
-            message(m, "Please draw a reference region on the map.", True)
+            flash(m, "Please draw a reference region on the map.")
             return
 
         # Get all drawn geometries
@@ -179,10 +289,13 @@ def set_search_region(e, m):
         ]
 
         # Convert to a multipolygon geometry with shapely
-        search_geom = shape({"type": "MultiPolygon", "coordinates": geoms})
+        search_geom = simplify_geometry(
+            m, MultiPolygon([Polygon(rings[0], rings[1:]) for rings in geoms])
+        )
 
         # Set the actual search region as a ee object
         m.qr = ee.Geometry(mapping(search_geom))
+        m.qr_coords = geometry_coordinates(search_geom)
 
         # Add the new ROI as a GeoDataFrame to the map
         m.add_gdf(
@@ -207,8 +320,7 @@ def set_search_region(e, m):
         m.qr_set = True
 
     except Exception as e:
-        message(m, f"Error setting search region: {e}", False)
-        message(m, f"Error setting search region: {e}", True, 5)
+        flash(m, f"Error setting search region: {e}", 5)
 
 
 def handle_upload_change(change, m):
@@ -228,33 +340,20 @@ def handle_upload_change(change, m):
     Raises:
         Exception: If there's an error setting the search region.
     """
+    import geopandas as gpd
+
     try:
         # Get the uploaded file from the ROS upload button
         uploaded_file = m.ros_upload_button.value
 
         if uploaded_file:
-            file_content = uploaded_file[0]["content"]
-            file_name = uploaded_file[0]["name"]
-
-            # Extract the files in a temporary directory and read the first *.shp file
-            if file_name.endswith(".zip"):
-                with tempfile.TemporaryDirectory() as tmpdir:
-                    with zipfile.ZipFile(BytesIO(file_content), "r") as zip_ref:
-                        zip_ref.extractall(tmpdir)
-                        shp_files = [f for f in Path(tmpdir).rglob("*.shp")]
-                        if shp_files:
-                            gdf = gpd.read_file(shp_files[0])
-            else:
-                # Geopandas can infer the format based on the file extension
-                gdf = gpd.read_file(BytesIO(file_content))
-
-            m.qr = ee.Geometry(mapping(gdf.unary_union))
+            geom = read_uploaded_geometry(m, uploaded_file[0])
+            m.qr = ee.Geometry(mapping(geom))
+            m.qr_coords = geometry_coordinates(geom)
 
             # Add the new query region as a GeoDataFrame to the map
             m.add_gdf(
-                gpd.GeoDataFrame(
-                    geometry=gpd.GeoSeries([gdf.unary_union]), crs="EPSG:4326"
-                ),
+                gpd.GeoDataFrame(geometry=[geom], crs="EPSG:4326"),
                 "Query Region",
                 style={
                     "color": "red",
@@ -271,5 +370,4 @@ def handle_upload_change(change, m):
             m.qr_set = True
 
     except Exception as e:
-        message(m, f"Error setting search region: {e}", False)
-        message(m, f"Error setting search region: {e}", True, 5)
+        flash(m, f"Error setting search region: {e}", 5)
@@ -7,54 +7,212 @@ pixels and mean vectors, executing searches or clustering operations, and handli
 interactions.
 """
 
-import matplotlib.pyplot as plt
-import matplotlib.colors as mcolors
+import hashlib
+import numpy as np
 import ee
 import geemap
-from shapely.geometry import Point, mapping
 from region_similarity.features import add_feature
-from region_similarity.helpers import message
+from region_similarity.helpers import flash, get_info, message
 from solara.lab import task
 
+# Maximum number of entries kept in the search cache of a map
+SEARCH_CACHE_SIZE = 64
+
+# Hexcodes of matplotlib's "tab20" colormap, used to color the clusters
+TAB20 = (
+    "#1f77b4",
+    "#aec7e8",
+    "#ff7f0e",
+    "#ffbb78",
+    "#2ca02c",
+    "#98df8a",
+    "#d62728",
+    "#ff9896",
+    "#9467bd",
+    "#c5b0d5",
+    "#8c564b",
+    "#c49c94",
+    "#e377c2",
+    "#f7b6d2",
+    "#7f7f7f",
+    "#c7c7c7",
+    "#bcbd22",
+    "#dbdb8d",
+    "#17becf",
+    "#9edae5",
+)
+
+# Dynamic World landcover classes, in the order of their label values
+LANDCOVER_CLASSES = (
+    "water",
+    "trees",
+    "grass",
+    "flooded_vegetation",
+    "crops",
+    "shrub_and_scrub",
+    "built",
+    "bare",
+    "snow_and_ice",
+)
+LANDCOVER_INDEX = {name: i for i, name in enumerate(LANDCOVER_CLASSES)}
+
+
+def geometry_hash(geometry):
+    """
+    Computes a stable hash of an Earth Engine geometry from its serialized graph.
+
+    Args:
+        geometry (ee.Geometry): Earth Engine geometry.
 
-def calc_distance(map, image, mean_vector, fun):
+    Returns:
+        str: Hex digest identifying the geometry.
     """
-    Calculates the distance between image pixel values and a mean vector using the specified distance function.
+    return hashlib.sha1(geometry.serialize().encode()).hexdigest()
+
+
+def cached(m, key, compute):
+    """
+    Returns the value cached under `key` in the search cache, computing it on a miss.
+
+    The cache keeps the most recently used entries up to `SEARCH_CACHE_SIZE`.
+
+    Args:
+        m (object): Map object holding the search cache.
+        key (tuple): Cache key.
+        compute (Callable): Function returning the value to cache.
+
+    Returns:
+        object: The cached value.
+    """
+    if key in m.caches.search:
+        m.caches.search[key] = m.caches.search.pop(key)
+    else:
+        m.caches.search[key] = compute()
+        if len(m.caches.search) > SEARCH_CACHE_SIZE:
+            del m.caches.search[next(iter(m.caches.search))]
+    return m.caches.search[key]
+
+
+def get_feature_stack(m):
+    """
+    Gets the stack of the feature images, in the order the features were added.
+
+    The stack is cached, so it is only rebuilt when the features change.
+
+    Args:
+        m (object): Map object containing the features and the search cache.
+
+    Returns:
+        tuple: The list of feature images and their stacked `ee.Image`.
+    """
+    feature_imgs = [feature_img for _, (_, feature_img, _) in m.features.items()]
+    feature_ids = tuple(id(feature_img) for feature_img in feature_imgs)
+    return cached(
+        m,
+        ("stack", feature_ids),
+        lambda: (feature_imgs, ee.Image.cat(feature_imgs)),
+    )
+
+
+def get_landcover(m, region):
+    """
+    Gets the Dynamic World landcover mosaic of a region over the period of interest.
+
+    The mosaic is cached per region and period, so changing the mask class reuses it.
+
+    Args:
+        m (object): Map object containing the period of interest and the search cache.
+        region (ee.Geometry): Region to get the landcover of.
+
+    Returns:
+        ee.Image: Image with the most frequent landcover class in the `label_mode` band.
+    """
+    start, end = m.start.isoformat(), m.end.isoformat()
+    return cached(
+        m,
+        ("landcover", geometry_hash(region), start, end),
+        lambda: geemap.dynamic_world(region, start, end, return_type="class").select(
+            "label_mode"
+        ),
+    )
+
+
+def euclidean_distance(image, roi_mean):
+    """
+    Calculates the band-wise Euclidean distance between an image and a mean image.
 
     Args:
-        map (object): Map object for displaying messages.
         image (ee.Image): Earth Engine image.
-        mean_vector (ee.Dictionary): Mean vector of pixel values.
-        fun (str): Distance function to use. Options are 'Euclidean', 'Manhattan', 'Cosine'.
+        roi_mean (ee.Image): Constant image with the mean of each band.
 
     Returns:
-        ee.Image: Image representing the calculated distances.
+        ee.Image: Image with the distance of each band.
     """
-    try:
-        roi_mean = ee.Image.constant(mean_vector.values())
+    return image.subtract(roi_mean).pow(ee.Number(2)).sqrt()
+
+
+def manhattan_distance(image, roi_mean):
+    """
+    Calculates the band-wise Manhattan distance between an image and a mean image.
+
+    Args:
+        image (ee.Image): Earth Engine image.
+        roi_mean (ee.Image): Constant image with the mean of each band.
+
+    Returns:
+        ee.Image: Image with the distance of each band.
+    """
+    return image.subtract(roi_mean).abs()
+
+
+def cosine_distance(image, roi_mean):
+    """
+    Calculates the band-wise cosine distance between an image and a mean image.
+
+    Args:
+        image (ee.Image): Earth Engine image.
+        roi_mean (ee.Image): Constant image with the mean of each band.
 
-        if fun == "Euclidean":
-            diff = image.subtract(roi_mean)
-            squared_diff = diff.pow(ee.Number(2))
-            distance = squared_diff.reduce("sum").sqrt()
+    Returns:
+        ee.Image: Image with the distance of each band.
+    """
+    dot_product = image.multiply(roi_mean)
+    norms = image.abs().multiply(roi_mean.abs())
+    cosine_similarity = dot_product.divide(norms)
+    return cosine_similarity.multiply(-1).add(1)
+
+
+# Distance functions by the name shown in the distance dropdown
+DISTANCE_FNS = {
+    "Euclidean": euclidean_distance,
+    "Manhattan": manhattan_distance,
+    "Cosine": cosine_distance,
+}
 
-        elif fun == "Manhattan":
-            diff = image.subtract(roi_mean).abs()
-            distance = diff.reduce("sum")
 
-        elif fun == "Cosine":
-            dot_product = image.multiply(roi_mean).reduce("sum")
-            image_norm = image.pow(2).reduce("sum").sqrt()
-            mean_norm = roi_mean.pow(2).reduce("sum").sqrt()
-            cosine_similarity = dot_product.divide(image_norm.multiply(mean_norm))
-            distance = ee.Image.constant(1).subtract(cosine_similarity)
+def calc_distance(map, image, mean_vector, band_names, fun):
+    """
+    Calculates the distance between image pixel values and a mean vector using the specified distance function.
+
+    The distance is computed band-wise, so that every band of the image gets its own distance band.
 
-        return distance
+    Args:
+        map (object): Map object for displaying messages.
+        image (ee.Image): Earth Engine image.
+        mean_vector (ee.Dictionary): Mean of the pixel values of each band.
+        band_names (list): Names of the bands of the image, in order.
+        fun (str): Distance function to use. Options are 'Euclidean', 'Manhattan', 'Cosine'.
+
+    Returns:
+        ee.Image: Image representing the calculated distances, with one band per input band.
+    """
+    try:
+        roi_mean = ee.Image.constant(mean_vector.values(band_names)).rename(band_names)
+        return DISTANCE_FNS[fun](image, roi_mean)
 
     except Exception as e:
         if map:
-            message(map, f"Error: {e}.", False)
-            message(map, f"Error: {e}.", True, 5)
+            flash(map, f"Error: {e}.", 5)
         return None
 
 
@@ -90,9 +248,9 @@ def generate_color_palette(n_clusters):
     Returns:
         list: List of color hexcodes.
     """
-    cmap = plt.get_cmap("tab20")
-    colors = [mcolors.rgb2hex(cmap(i % 20)) for i in range(n_clusters)]
-    return colors
+    if n_clusters <= len(TAB20):
+        return list(TAB20[:n_clusters])
+    return [TAB20[i % len(TAB20)] for i in range(n_clusters)]
 
 
 @task
@@ -134,19 +292,16 @@ def async_add_distance_map(m, region_of_search):
     # Display a message
     message(m, f"[Background task] Calculating distance maps...", False)
 
-    # Get the minimum and maximum values for the visualization
-    min_val = m.average_distance.reduceRegion(
-        reducer=ee.Reducer.min(),
-        geometry=region_of_search,
-        scale=100,
-        bestEffort=True,
-    ).getInfo()["mean"]
-    max_val = m.average_distance.reduceRegion(
-        reducer=ee.Reducer.max(),
-        geometry=region_of_search,
-        scale=100,
-        bestEffort=True,
-    ).getInfo()["mean"]
+    # Get the minimum and maximum values for the visualization in a single request
+    stats = get_info(
+        m.average_distance.reduceRegion(
+            reducer=ee.Reducer.minMax(),
+            geometry=region_of_search,
+            scale=100,
+            bestEffort=True,
+        )
+    )
+    min_val, max_val = stats["mean_min"], stats["mean_max"]
 
     # Update the minimum/maximum values for thresholding
     if min_val >= m.max_value_slider.max:
@@ -191,48 +346,23 @@ def cluster(e, m):
         elif m.distance_fun == "Manhattan":
             distance_fun = "Manhattan"
         else:
-            message(
+            flash(
                 m,
                 "Warning: Cosine similarity is not supported for clustering. Defaulting to Euclidean distance.",
-                False,
             )
             distance_fun = "Euclidean"
-            message(
-                m,
-                "Warning: Cosine similarity is not supported for clustering. Defaulting to Euclidean distance.",
-                True,
-            )
 
         # Stack the features
-        m.feature_img = ee.Image.cat(
-            [feature_img for _, (_, feature_img) in m.features.items()]
-        )
+        _, m.feature_img = get_feature_stack(m)
 
         # Apply dynamic world-masking if specified
         if m.mask != "All":
-            classes = [
-                "water",
-                "trees",
-                "grass",
-                "flooded_vegetation",
-                "crops",
-                "shrub_and_scrub",
-                "built",
-                "bare",
-                "snow_and_ice",
-            ]
-
             # Get the mosaic dynamic world image
-            landcover = geemap.dynamic_world(
-                m.qr,
-                m.start.isoformat(),
-                m.end.isoformat(),
-                return_type="class",
-            ).select("label_mode")
+            landcover = get_landcover(m, m.qr)
 
             # Mask the image using the class of interest
             m.feature_img = m.feature_img.updateMask(
-                landcover.eq(classes.index(m.mask))
+                landcover.eq(LANDCOVER_INDEX[m.mask])
             )
 
         # Create the training dataset
@@ -256,8 +386,7 @@ def cluster(e, m):
         async_add_clusters(n_clusters, m)
 
     except Exception as e:
-        message(m, f"Error: {e}.", False)
-        message(map, f"Error: {e}.", True, 5)
+        flash(m, f"Error: {e}.", 5)
 
 
 def search(e, m):
@@ -272,81 +401,103 @@ def search(e, m):
     try:
 
         # Stack the features
-        m.feature_img = ee.Image.cat(
-            [feature_img for _, (_, feature_img) in m.features.items()]
+        feature_imgs, m.feature_img = get_feature_stack(m)
+        band_names = [band for _, (_, _, bands) in m.features.items() for band in bands]
+
+        # The cache values keep a reference to the feature images so their ids stay unique
+        feature_ids = tuple(id(feature_img) for feature_img in feature_imgs)
+        roi_hash = geometry_hash(m.roi)
+
+        # Calculate the mean of every feature within the region of interest at once
+        _, roi_mean_vector = cached(
+            m,
+            ("mean", feature_ids, roi_hash),
+            lambda: (
+                feature_imgs,
+                m.feature_img.reduceRegion(
+                    reducer=ee.Reducer.mean(),
+                    geometry=m.roi,
+                    bestEffort=True,
+                    scale=100,
+                ),
+            ),
         )
 
-        # Now that we have the aliases and images, we can calculate the distances for each feature
-        distance_maps = list()
-
-        # Iterate over the features and calculate the distance maps
-        for _, (_, feature_img) in m.features.items():
-
-            # Calculate the mean of pixel vectors within the region of interest
-            roi_mean_vector = feature_img.reduceRegion(
-                reducer=ee.Reducer.mean(),
-                geometry=m.roi,
-                bestEffort=True,
-                scale=100,
-            )
-
-            # Apply the distance calculation function
-            distance_map = calc_distance(
-                m, feature_img, roi_mean_vector, m.distance_fun
-            )
-
-            # Save the layer to the list
-            distance_maps.append(distance_map)
-
-        # Stack the distance maps
-        m.distances = ee.Image.cat(distance_maps)
+        # Calculate the distance maps of all the features in a single image
+        _, m.distances = cached(
+            m,
+            ("distance", feature_ids, roi_hash, m.distance_fun),
+            lambda: (
+                feature_imgs,
+                calc_distance(
+                    m, m.feature_img, roi_mean_vector, band_names, m.distance_fun
+                ),
+            ),
+        )
 
         # Calculate the average distance across the bands
         m.average_distance = m.distances.reduce(ee.Reducer.mean())
 
         # Calculate the difference
-        m.diff = m.qr.difference(right=m.roi, maxError=0.01)
+        m.diff = cached(
+            m,
+            ("diff", geometry_hash(m.qr), roi_hash),
+            lambda: m.qr.difference(right=m.roi, maxError=0.01),
+        )
 
         # Clip it to remove the region of interest
         m.average_distance = m.average_distance.clip(m.diff)
 
         # Apply dynamic world-masking if specified
         if m.mask != "All":
-            classes = [
-                "water",
-                "trees",
-                "grass",
-                "flooded_vegetation",
-                "crops",
-                "shrub_and_scrub",
-                "built",
-                "bare",
-                "snow_and_ice",
-            ]
-
             # Get the mosaic dynamic world image
-            landcover = geemap.dynamic_world(
-                m.diff,
-                m.start.isoformat(),
-                m.end.isoformat(),
-                return_type="class",
-            ).select("label_mode")
-
-            # Mask the image using the class of interest
-            m.average_distance = m.average_distance.updateMask(
-                landcover.eq(classes.index(m.mask))
-            )
+            landcover = get_landcover(m, m.diff)
 
-            # Mask the image using the class of interest
-            m.feature_img = m.feature_img.updateMask(
-                landcover.eq(classes.index(m.mask))
-            )
+            # Mask the images using the class of interest
+            mask = landcover.eq(LANDCOVER_INDEX[m.mask])
+            m.average_distance = m.average_distance.updateMask(mask)
+            m.feature_img = m.feature_img.updateMask(mask)
 
         async_add_distance_map(m, m.qr)
 
     except Exception as e:
-        message(m, f"Error: {e}.", False)
-        message(map, f"Error: {e}.", True, 5)
+        flash(m, f"Error: {e}.", 5)
+
+
+@task
+def async_show_similarity(m, latlon, seq):
+    """
+    Asynchronously samples the distances at a clicked location and displays them.
+
+    Args:
+        m (object): Map object.
+        latlon (list): The `[lat, lon]` coordinates of the click.
+        seq (int): Sequence number of the click.
+    """
+
+    try:
+
+        # Sample the distances at the clicked location
+        p = ee.Geometry.Point([latlon[1], latlon[0]])
+        fs = get_info(m.distances.sample(p, 1))["features"]
+
+        # Drop the result if a newer click arrived in the meantime
+        if seq != m.click_seq:
+            return
+
+        # Earth Engine sorts the properties by name, so read them in the order of the features
+        properties = fs[0]["properties"]
+        band_names = [band for _, (_, _, bands) in m.features.items() for band in bands]
+        click_distances = np.asarray(
+            [properties[band] for band in band_names if band in properties], dtype=float
+        )
+        scale = 3
+        percents = (scale - np.minimum(scale, click_distances)) / scale * 100
+        percents = percents.astype(int).astype(str).tolist()
+        flash(m, "% Similarity: " + ", ".join(percents))
+
+    except Exception as e:
+        flash(m, f"Error: {e}.", 5)
 
 
 def handle_interaction(m, **kwargs):
@@ -365,18 +516,8 @@ def handle_interaction(m, **kwargs):
 
             # Handle click events for displaying similarity percentages
             if type(m.distances) == ee.image.Image:
-                p0, p1 = latlon[1], latlon[0]
-                p = ee.Geometry(mapping(Point(p0, p1)))
-                fs = m.distances.sample(p, 1).getInfo()["features"]
-                click_distances = list(fs[0]["properties"].values())
-                scale = 3
-                percents = [
-                    str(int(((scale - min(scale, e)) / scale) * 100))
-                    for e in click_distances
-                ]
-                message(m, "% Similarity: " + ", ".join(percents), False)
-                message(m, "% Similarity: " + ", ".join(percents), True)
+                m.click_seq += 1
+                async_show_similarity(m, latlon, m.click_seq)
 
     except Exception as e:
-        message(m, f"Error: {e}.", False)
-        message(m, f"Error: {e}.", True, 5)
+        flash(m, f"Error: {e}.", 5)
@@ -6,19 +6,171 @@ It provides functionality to load and save use case configurations, including re
 """
 
 from datetime import datetime, date
+import functools
+import re
 import uuid
 import yaml
 from pathlib import Path
-import geopandas as gpd
 from solara.lab import task
 import ee
-from shapely.geometry import shape, mapping
-from region_similarity.variables import add_alias
+from shapely.geometry import MultiPolygon, Polygon
+from region_similarity.variables import add_aliases
 from region_similarity.features import add_feature
-from region_similarity.helpers import message
+from region_similarity.helpers import flash, get_info
+from region_similarity.search import DISTANCE_FNS, LANDCOVER_CLASSES
+
+# Largest spec file accepted, in bytes, checked before parsing
+MAX_SPEC_SIZE = 1_000_000
+
+# Aliases are `name:product:layer:start:end:aggregation`, the name and period are optional
+ALIAS_PATTERN = re.compile(r"([^:]*):([^:]+):([^:]+):([^:]*):([^:]*):([^:]+)")
+
+# Use the libyaml bindings when PyYAML was built with them
+try:
+    from yaml import CSafeLoader as Loader, CSafeDumper as Dumper
+except ImportError:
+    from yaml import SafeLoader as Loader, SafeDumper as Dumper
+
+
+def load_spec(content):
+    """
+    Parse the content of a use case spec file.
+
+    Args:
+        content (str | bytes | memoryview): The YAML content of the spec file.
+
+    Returns:
+        dict: The specification data.
+
+    Raises:
+        ValueError: If the content is larger than `MAX_SPEC_SIZE`.
+    """
+    if len(content) > MAX_SPEC_SIZE:
+        raise ValueError(f"spec file is larger than {MAX_SPEC_SIZE} bytes")
+    # Uploaded files are memoryviews, which the YAML loader does not accept
+    if isinstance(content, memoryview):
+        content = bytes(content)
+    return yaml.load(content, Loader=Loader)
+
+
+@functools.lru_cache(maxsize=256)
+def parse_spec_date(text):
+    """
+    Parse a `dd/mm/yyyy` date of a spec file alias.
+
+    Args:
+        text (str): The date to parse.
+
+    Returns:
+        date: The parsed date.
+    """
+    # Slice zero-padded dates directly, strptime also accepts unpadded ones
+    if len(text) == 10 and text[2] == text[5] == "/":
+        try:
+            return date(int(text[6:]), int(text[3:5]), int(text[:2]))
+        except ValueError:
+            pass
+    return datetime.strptime(text, "%d/%m/%Y").date()
+
+
+@functools.lru_cache(maxsize=256)
+def parse_iso_date(text):
+    """
+    Parse a `yyyy-mm-dd` date of an alias period.
+
+    Args:
+        text (str): The date to parse.
+
+    Returns:
+        date: The parsed date.
+    """
+    try:
+        return date.fromisoformat(text)
+    except ValueError:
+        return datetime.strptime(text, "%Y-%m-%d").date()
+
+
+def get_coordinates(region, coordinates):
+    """
+    Get the coordinates of a region, only requesting them from Earth Engine if they are not known locally.
+
+    Args:
+        region (ee.Geometry): The region.
+        coordinates (list): The coordinates kept when the region was set, or None.
+
+    Returns:
+        list: The GeoJSON coordinates of the region.
+    """
+    return coordinates if coordinates is not None else get_info(region.coordinates())
+
+
+def validate_spec(spec_data):
+    """
+    Check the structure of a spec before any of it is applied to the map.
+
+    Args:
+        spec_data (dict): The specification data.
+
+    Returns:
+        str: A description of the first problem found, or None if the spec is valid.
+    """
+    if not isinstance(spec_data, dict):
+        return "The spec file must be a mapping."
+    if "task" not in spec_data or not spec_data.get("aliases"):
+        return "'task' and at least one 'alias' are required in the spec file."
+    if spec_data["task"] not in ("search", "cluster"):
+        return f"Invalid task {spec_data['task']}, expected `search` or `cluster`."
+
+    regions = spec_data.get("regions") or {}
+    if not isinstance(regions, dict):
+        return "'regions' must be a mapping."
+    for key in ("query_region", "reference_region"):
+        if regions.get(key) is not None and not isinstance(regions[key], list):
+            return f"'{key}' must be a list of polygon coordinates."
+    clusters = regions.get("number_of_clusters", 5)
+    if not isinstance(clusters, int) or isinstance(clusters, bool):
+        return "'number_of_clusters' must be an integer."
+
+    aliases = spec_data["aliases"]
+    if not isinstance(aliases, list) or not all(isinstance(a, str) for a in aliases):
+        return "'aliases' must be a list of `name:product:band:start:end:agg` strings."
+
+    features = spec_data.get("features") or []
+    if not isinstance(features, list) or not all(
+        isinstance(f, str) and f.count(":") == 1 for f in features
+    ):
+        return "'features' must be a list of `name:expression` strings."
+
+    distance = spec_data.get("distance")
+    if distance and distance not in DISTANCE_FNS:
+        return f"Invalid distance {distance}."
+    land_cover = spec_data.get("land_cover")
+    if land_cover and land_cover != "All" and land_cover not in LANDCOVER_CLASSES:
+        return f"Invalid land cover {land_cover}."
+
+    return None
 
 
 @task
+def import_spec_file(m, content):
+    """
+    Parse an uploaded spec file and import it, off the UI thread.
+
+    Args:
+        m: The map object to update with the imported specification.
+        content (memoryview): The content of the uploaded spec file.
+
+    Returns:
+        None. Displays a message if the file cannot be parsed or imported.
+    """
+    try:
+        import_spec(m, load_spec(content))
+    except yaml.YAMLError as e:
+        flash(m, f"Error parsing YAML file: {str(e)}")
+    except Exception as e:
+        flash(m, f"Error importing specification: {str(e)}")
+
+
 def import_spec(m, spec_data):
     """
     Import and process use case information for region similarity analysis.
@@ -33,28 +185,18 @@ def import_spec(m, spec_data):
     Returns:
         None. Updates the map object and displays messages about the import process.
     """
-    # Check for required fields
-    if (
-        "task" not in spec_data
-        or "aliases" not in spec_data
-        or not spec_data["aliases"]
-    ):
-        message(
-            m,
-            "Error: 'task' and at least one 'alias' are required in the spec file.",
-            False,
-        )
-        message(
-            m,
-            "Error: 'task' and at least one 'alias' are required in the spec file.",
-            True,
-        )
+    import geopandas as gpd
+
+    # Check the whole spec before touching the map
+    error = validate_spec(spec_data)
+    if error:
+        flash(m, f"Error: {error}")
         return
 
     task = spec_data["task"]
-    regions = spec_data.get("regions", {})
+    regions = spec_data.get("regions") or {}
     aliases = spec_data["aliases"]
-    features = spec_data.get("features", [])
+    features = spec_data.get("features") or []
     distance = spec_data.get("distance")
     land_cover = spec_data.get("land_cover")
 
@@ -62,27 +204,20 @@ def import_spec(m, spec_data):
     query_region = regions.get("query_region")
     if not query_region:
         if not m.qr:
-            message(m, "Error: No query region provided in spec or set on map.", False)
-            message(m, "Error: No query region provided in spec or set on map.", True)
+            flash(m, "Error: No query region provided in spec or set on map.")
             return
-        query_region = m.qr.coordinates().getInfo()
+        query_region = get_coordinates(m.qr, m.qr_coords)
 
     if task == "search":
         reference_region = regions.get("reference_region")
         if not reference_region:
             if not m.roi:
-                message(
-                    m,
-                    "Error: No reference region provided in spec or set on map for search task.",
-                    False,
-                )
-                message(
+                flash(
                     m,
                     "Error: No reference region provided in spec or set on map for search task.",
-                    True,
                 )
                 return
-            reference_region = m.roi.coordinates().getInfo()
+            reference_region = get_coordinates(m.roi, m.roi_coords)
 
     # Set default period
     default_start = m.start_date.value
@@ -94,40 +229,32 @@ def import_spec(m, spec_data):
     )
 
     # Process aliases
-    processed_aliases = []
-    for alias in aliases:
-        alias_parts = alias.split(":")
-        if len(alias_parts) != 6:
-            message(m, f"Error: Invalid alias format: {alias}", False)
-            message(m, f"Error: Invalid alias format: {alias}", True)
+    processed_aliases = [None] * len(aliases)
+    for i, alias in enumerate(aliases):
+        match = ALIAS_PATTERN.fullmatch(alias)
+        if not match:
+            if alias.count(":") != 5:
+                flash(m, f"Error: Invalid alias format: {alias}")
+            else:
+                alias_name = alias.split(":")[0]
+                flash(m, f"Error: Incomplete alias specification for {alias_name}")
             return
 
-        alias_name, product, layer, start, end, agg = alias_parts
-
-        if not product or not layer or not agg:
-            message(m, f"Error: Incomplete alias specification for {alias_name}", False)
-            message(m, f"Error: Incomplete alias specification for {alias_name}", True)
-            return
+        alias_name, product, layer, start, end, agg = match.groups()
 
         if not start or not end:
             if default_period is None:
-                message(
-                    m,
-                    f"Error: Missing period for alias {alias_name} and no default period set.",
-                    False,
-                )
-                message(
+                flash(
                     m,
                     f"Error: Missing period for alias {alias_name} and no default period set.",
-                    True,
                 )
                 return
             start, end = default_period
         else:
-            start = datetime.strptime(start, "%d/%m/%Y").date()
-            end = datetime.strptime(end, "%d/%m/%Y").date()
+            start = parse_spec_date(start)
+            end = parse_spec_date(end)
 
-        processed_aliases.append((alias_name, product, layer, start, end, agg))
+        processed_aliases[i] = (alias_name, product, layer, start, end, agg)
 
     # Set task-specific parameters
     if task == "cluster":
@@ -140,8 +267,9 @@ def import_spec(m, spec_data):
 
     # Set regions
     if query_region:
-        query_geom = shape({"type": "MultiPolygon", "coordinates": query_region})
-        m.qr = ee.Geometry(mapping(query_geom))
+        m.qr = ee.Geometry.MultiPolygon(query_region)
+        query_geom = MultiPolygon([Polygon(r[0], r[1:]) for r in query_region])
+        m.qr_coords = query_region
         m.add_gdf(
             gpd.GeoDataFrame(geometry=[query_geom], crs="EPSG:4326"),
             "Query Region",
@@ -158,8 +286,9 @@ def import_spec(m, spec_data):
         m.qr_set = True
 
     if task == "search" and reference_region:
-        reference_geom = shape({"type": "MultiPolygon", "coordinates": reference_region})
-        m.roi = ee.Geometry(mapping(reference_geom))
+        m.roi = ee.Geometry.MultiPolygon(reference_region)
+        reference_geom = MultiPolygon([Polygon(r[0], r[1:]) for r in reference_region])
+        m.roi_coords = reference_region
         m.add_gdf(
             gpd.GeoDataFrame(geometry=[reference_geom], crs="EPSG:4326"),
             "Reference Region",
@@ -176,15 +305,7 @@ def import_spec(m, spec_data):
         m.roi_set = True
 
     # Add aliases
-    for i, (alias_name, product, layer, start, end, agg) in enumerate(
-        processed_aliases
-    ):
-        if i == len(processed_aliases) - 1:
-            add_alias(
-                None, m, alias_name, product, layer, start, end, agg, list_aliases=True
-            )
-        else:
-            add_alias(None, m, alias_name, product, layer, start, end, agg)
+    add_aliases(m, processed_aliases)
 
     # Add features
     for feature in features:
@@ -198,8 +319,7 @@ def import_spec(m, spec_data):
     if land_cover:
         m.mask_dropdown.value = land_cover
 
-    message(m, "Specification loaded successfully.", False)
-    message(m, "Specification loaded successfully.", True)
+    flash(m, "Specification loaded successfully.")
 
 
 def export_spec(e, m):
@@ -219,29 +339,24 @@ def export_spec(e, m):
     # Generate aliases
     aliases = list()
     for alias_name, (dataset, layer, agg_fun, start, end, _) in m.aliases.items():
-        start = (
-            datetime.strptime(start, "%Y-%m-%d").date()
-            if isinstance(start, str)
-            else start
-        )
-        end = datetime.strptime(end, "%Y-%m-%d").date() if isinstance(end, str) else end
+        start = parse_iso_date(start) if isinstance(start, str) else start
+        end = parse_iso_date(end) if isinstance(end, str) else end
         alias_str = f"{alias_name}:{dataset}:{layer}:{start.strftime('%d/%m/%Y')}:{end.strftime('%d/%m/%Y')}:{agg_fun}"
         aliases.append(alias_str)
 
     # If there are no aliases, stop
     if not aliases:
-        message(m, "No aliases found. Please add at least one alias.", False)
-        message(m, "No aliases found. Please add at least one alias.", True)
+        flash(m, "No aliases found. Please add at least one alias.")
         return
 
     # Generate features
     features = list()
-    for name, (expression, _) in m.features.items():
+    for name, (expression, _, _) in m.features.items():
         features.append(f"{name}:{expression}")
 
     # Get geometries
-    query_region = m.qr.coordinates().getInfo() if m.qr else []
-    reference_region = m.roi.coordinates().getInfo() if m.roi else []
+    query_region = get_coordinates(m.qr, m.qr_coords) if m.qr else []
+    reference_region = get_coordinates(m.roi, m.roi_coords) if m.roi else []
 
     # Ensure proper nesting
     def ensure_depth(lst, target_depth):
@@ -267,8 +382,7 @@ def export_spec(e, m):
 
     # If there is no query region, return
     if not query_region:
-        message(m, "No query region found. Please set the query region.", False)
-        message(m, "No query region found. Please set the query region.", True)
+        flash(m, "No query region found. Please set the query region.")
         return
 
     # Determine task
@@ -298,10 +412,16 @@ def export_spec(e, m):
 
     # Convert to YAML and save
     with open(file_path, "w") as file:
-        yaml.dump(spec_data, file)
+        yaml.dump(
+            spec_data,
+            file,
+            Dumper=Dumper,
+            sort_keys=False,
+            default_flow_style=None,
+            allow_unicode=True,
+        )
 
     # Generate download link
     download_link = f"{m.url}/static/public/{filename}"
 
-    message(m, f"Download link: {download_link}", False)
-    message(m, f"Download link: {download_link}", True, duration=5)
+    flash(m, f"Download link: {download_link}", 5)
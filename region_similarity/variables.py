@@ -6,41 +6,81 @@ and performing various operations on image collections and layers.
 """
 
 import ee
+import functools
 import requests
 import ipywidgets as widgets
 from region_similarity.features import remove_feature
-from region_similarity.helpers import message
-from solara import display
+from region_similarity.helpers import (
+    ee_gate,
+    executor,
+    flash,
+    get_info,
+    get_qr_roi,
+    message,
+    run_with_timeout,
+)
 from solara.lab import task
-from multiprocess import Pool
 
-
-def check_image_validity(image):
+# Reuse the connection to the STAC catalog across band lookups
+session = requests.Session()
+session.mount(
+    "https://", requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=4)
+)
+
+# Aggregation functions of image collections by the name shown in the aggregation dropdown
+AGGREGATIONS = {
+    "LAST": lambda ds: ds.sort("system:time_start", False).first(),
+    "FIRST": lambda ds: ds.first(),
+    "MAX": lambda ds: ds.max(),
+    "MIN": lambda ds: ds.min(),
+    "MEAN": lambda ds: ds.mean(),
+    "MEDIAN": lambda ds: ds.median(),
+    "SUM": lambda ds: ds.sum(),
+    "MODE": lambda ds: ds.mode(),
+}
+
+
+@functools.lru_cache(maxsize=512)
+def check_image_validity(dataset_id, layer_id):
     """
-    Check if an Earth Engine image is valid.
+    Check if an Earth Engine product band is a valid single image.
+
+    The asset type and bands are looked up once per product band and cached. Errors
+    reaching Earth Engine are raised and not cached, since they say nothing of the asset.
 
     Args:
-        image (ee.Image): The Earth Engine image to check.
+        dataset_id (str): The Earth Engine product ID.
+        layer_id (str): The band name.
 
     Returns:
         bool: True if the image is valid, False otherwise.
+
+    Raises:
+        ee.EEException: If Earth Engine could not be reached, in which case nothing is cached.
     """
-    try:
-        return image.bandNames().size().getInfo() > 0
-    except Exception as e:
+    # The lookup returns None for a missing asset and raises on any other error
+    with ee_gate:
+        asset = ee.data.getInfo(dataset_id)
+    if asset is None or asset.get("type", "").upper() != "IMAGE":
         return False
+    return any(band.get("id") == layer_id for band in asset.get("bands", []))
 
 
-def get_bands(product, m):
+@functools.lru_cache(maxsize=512)
+def lookup_bands(product):
     """
-    Retrieve the band names for a given Earth Engine product.
+    Look up the band names of an Earth Engine product, from its STAC entry or from Earth Engine itself.
+
+    Successful lookups are cached, so each product is only looked up once.
 
     Args:
         product (str): The Earth Engine product ID.
-        m (object): Map object containing various attributes and methods.
 
     Returns:
-        list: A list of band names for the given product.
+        tuple: The band names of the product.
+
+    Raises:
+        Exception: If the product is neither in the STAC catalog nor a valid collection or image.
     """
     try:
         root = "https://storage.googleapis.com/earthengine-stac/catalog"
@@ -48,22 +88,36 @@ def get_bands(product, m):
         category = pieces[0]
         stac_name = "_".join(pieces)
         url = f"{root}/{category}/{stac_name}.json"
-        response = requests.get(url)
+        response = session.get(url, timeout=(3, 10))
+        response.raise_for_status()
         data = response.json()
         bands = [band["name"] for band in data["summaries"]["eo:bands"]]
     except Exception as e:
         try:
             dataset = ee.ImageCollection(product).first()
-            bands = dataset.bandNames().getInfo()
+            bands = get_info(dataset.bandNames())
         except Exception as e:
-            try:
-                dataset = ee.Image(product)
-                bands = dataset.bandNames().getInfo()
-            except Exception as e:
-                message(m, "Error loading bands.", False)
-                message(m, "Error loading bands.", True, 1)
-                bands = list()
-    return bands
+            dataset = ee.Image(product)
+            bands = get_info(dataset.bandNames())
+    return tuple(bands)
+
+
+def get_bands(product, m):
+    """
+    Retrieve the band names for a given Earth Engine product.
+
+    Args:
+        product (str): The Earth Engine product ID.
+        m (object): Map object containing various attributes and methods.
+
+    Returns:
+        list: A list of band names for the given product.
+    """
+    try:
+        return list(lookup_bands(product))
+    except Exception as e:
+        flash(m, "Error loading bands.", 1)
+        return list()
 
 
 def update_custom_product(e, m):
@@ -99,6 +153,52 @@ def update_custom_product(e, m):
     message(m, "Loading bands...", True, 0.1)
 
 
+def on_remove_alias_click(button):
+    """
+    Handle a click on the remove button of an alias row.
+
+    The alias and the map are stored on the button, so every row shares this handler.
+
+    Args:
+        button (widgets.Button): The clicked remove button.
+
+    Returns:
+        None
+    """
+    remove_alias(button.alias, button.m)
+
+
+def alias_row(alias, dataset, layer, agg_fun, m):
+    """
+    Build the row displaying an alias along with its remove button.
+
+    Args:
+        alias (str): The alias.
+        dataset (str): The Earth Engine product ID of the alias.
+        layer (str): The band of the alias.
+        agg_fun (str): The aggregation function of the alias.
+        m (object): Map object containing various attributes and methods.
+
+    Returns:
+        widgets.HBox: The row widget.
+    """
+    remove_button = widgets.Button(
+        description="x",
+        layout=widgets.Layout(width="20px", text_align="center", padding="0"),
+    )
+    spacer = widgets.HBox([], layout=widgets.Layout(flex="1 1 auto"))
+    remove_button.alias, remove_button.m = alias, m
+    remove_button.on_click(on_remove_alias_click)
+    return widgets.HBox(
+        [
+            widgets.Label(f"{alias}: {dataset.split('/')[-1]}:{layer}:{agg_fun}"),
+            spacer,
+            remove_button,
+        ],
+        layout=widgets.Layout(width="100%"),
+    )
+
+
 def remove_alias(alias, m):
     """
     Remove an alias from the map and update the UI.
@@ -117,32 +217,16 @@ def remove_alias(alias, m):
     # Drop the alias from the aliases dictionary
     del m.aliases[alias]
 
-    # Clear the output widget and print the added variables
-    with m.added_variables_output:
-        m.added_variables_output.clear_output()
-        for alias, (dataset, layer, agg_fun, _, _, _) in m.aliases.items():
-            remove_button = widgets.Button(
-                description="x",
-                layout=widgets.Layout(width="20px", text_align="center", padding="0"),
-            )
-            spacer = widgets.HBox([], layout=widgets.Layout(flex="1 1 auto"))
-            remove_button.on_click(lambda _, a=alias: remove_alias(a, m))
-            display(
-                widgets.HBox(
-                    [
-                        widgets.Label(
-                            f"{alias}: {dataset.split('/')[-1]}:{layer}:{agg_fun}"
-                        ),
-                        spacer,
-                        remove_button,
-                    ],
-                    layout=widgets.Layout(width="100%"),
-                )
-            )
+    # Remove the alias's row from the added variables
+    row = m.alias_rows.pop(alias)
+    m.added_variables_output.children = tuple(
+        child for child in m.added_variables_output.children if child is not row
+    )
+    row.close()
 
     # Find the features that include the alias
     features_to_remove = [
-        name for name, (expression, _) in m.features.items() if alias in expression
+        name for name, (expression, _, _) in m.features.items() if alias in expression
     ]
 
     # Remove the features that include the alias
@@ -164,13 +248,15 @@ def get_img_minmax(ds, alias, scale=100, tile_scale=1, max_pixels=1e9):
     Returns:
         tuple: A tuple containing the minimum and maximum values.
     """
-    min_max = ds.reduceRegion(
-        reducer=ee.Reducer.minMax(),
-        tileScale=tile_scale,
-        scale=scale,
-        maxPixels=max_pixels,
-        bestEffort=True,
-    ).getInfo()
+    min_max = get_info(
+        ds.reduceRegion(
+            reducer=ee.Reducer.minMax(),
+            tileScale=tile_scale,
+            scale=scale,
+            maxPixels=max_pixels,
+            bestEffort=True,
+        )
+    )
     return min_max[f"{alias}_min"], min_max[f"{alias}_max"]
 
 
@@ -186,13 +272,8 @@ def run_add_alias(ds, alias):
         tuple: A tuple containing the minimum and maximum values.
     """
 
-    # Simulate a long operation to get min/max
-    min_val, max_val = get_img_minmax(ds=ds, alias=alias)
-
-    # Compute the image
-    _ = ds.getInfo()
-
-    return min_val, max_val
+    # Get min/max in a single request, which also fails if the image cannot be computed
+    return get_img_minmax(ds=ds, alias=alias)
 
 
 @task
@@ -214,16 +295,13 @@ def async_add_alias(ds, alias, m, timeout_seconds=10, attempts=3):
     # Add a message
     message(m, f"[Background task] Loading `{alias}`...", False)
 
-    pool = Pool(processes=1)  # Create a single process pool
-
     for attempt in range(attempts):
         try:
 
-            # Start the process asynchronously using apply_async
-            result = pool.apply_async(run_add_alias, (ds, alias))
-
             # Get the result with a timeout. This will raise a TimeoutError if it exceeds the timeout.
-            min_val, max_val = result.get(timeout=timeout_seconds)
+            min_val, max_val = run_with_timeout(
+                run_add_alias, (ds, alias), timeout_seconds
+            )
 
             # Visualization task
             viz = {
@@ -249,22 +327,124 @@ def async_add_alias(ds, alias, m, timeout_seconds=10, attempts=3):
         except Exception as e:
 
             # We got a failure, it's simple to just say that it failed and move on to the next attempt.
-            message(m, f"Attempt {attempt + 1} failed. Retrying...", False)
-            message(m, f"Attempt {attempt + 1} failed. Retrying...", True, 1)
+            flash(m, f"Attempt {attempt + 1} failed. Retrying...", 1)
 
             # If it's the last attempt, we will not retry
             if attempt == attempts - 1:
                 message(m, f"[Background task] Loading `{alias}`...", True, 0.1)
-                message(m, f"Consider a lower resolution.", False)
-                message(m, f"Consider a lower resolution.", True, 1)
+                flash(m, f"Consider a lower resolution.", 1)
                 return
 
             else:
                 # If it's not the last attempt, we will retry
                 continue
 
-    pool.close()  # Close the pool
-    pool.join()  # Ensure all processes have finished
+
+def default_alias(layer_id, agg_fun):
+    """
+    Names an alias that was left empty after its band and aggregation function.
+
+    Args:
+        layer_id (str): The band name.
+        agg_fun (str): Aggregation function.
+
+    Returns:
+        str: The alias, e.g. `MEAN(B4)`.
+    """
+    return f"{agg_fun}({layer_id})" if agg_fun != "NONE" else layer_id
+
+
+def build_alias_image(m, alias, dataset_id, layer_id, agg_fun, start_date, end_date):
+    """
+    Builds the image of an alias, checking with Earth Engine that it has data.
+
+    The map is only read, so the image can be built outside of the UI thread.
+
+    Args:
+        m (object): Map object containing various attributes and methods.
+        alias (str): The alias.
+        dataset_id (str): The Earth Engine product ID.
+        layer_id (str): The band name.
+        agg_fun (str): Aggregation function.
+        start_date (str): Start date for filtering, in ISO format.
+        end_date (str): End date for filtering, in ISO format.
+
+    Returns:
+        ee.Image: The image of the alias.
+
+    Raises:
+        ValueError: If there is no data for the regions and period, or the aggregation
+            function is invalid.
+    """
+
+    # Set the region of interest
+    qr_roi = get_qr_roi(m)
+
+    # An attempt to grab an early win if the agg_fun is `LAST` and the user wants an image instead of a collection
+    ds = None
+    if agg_fun == "LAST" and check_image_validity(dataset_id, layer_id):
+        ds = ee.Image(dataset_id).select(layer_id)
+
+    # If the user does not want an image, we simply load the collection.
+    if not ds:
+        ds = ee.ImageCollection(dataset_id).select(layer_id)
+        ds = ds.filterDate(start_date, end_date)
+        ds = ds.filterBounds(qr_roi)
+        # Only count up to one image, the full size is not needed
+        if not get_info(ds.limit(1).size()):
+            raise ValueError(
+                "No data available for the selected region and time period."
+            )
+
+    # Only do this if `ds` is a collection
+    if isinstance(ds, ee.ImageCollection):
+        if agg_fun not in AGGREGATIONS:
+            raise ValueError(f"aggregation function {agg_fun} is invalid")
+        ds = AGGREGATIONS[agg_fun](ds)
+
+    # Clip the image to the query region
+    ds = ds.clip(qr_roi)
+
+    # Rename the band to the alias
+    return ds.rename(alias)
+
+
+def register_alias(m, alias, dataset_id, layer_id, agg_fun, start_date, end_date, ds):
+    """
+    Registers a built alias on the map, displays it and starts loading its layer.
+
+    Args:
+        m (object): Map object containing various attributes and methods.
+        alias (str): The alias.
+        dataset_id (str): The Earth Engine product ID.
+        layer_id (str): The band name.
+        agg_fun (str): Aggregation function.
+        start_date (str): Start date for filtering, in ISO format.
+        end_date (str): End date for filtering, in ISO format.
+        ds (ee.Image): The image of the alias.
+
+    Returns:
+        None
+    """
+
+    # Add the alias to the dictionary
+    m.aliases[alias] = [dataset_id, layer_id, agg_fun, start_date, end_date, ds]
+
+    # Display the alias, replacing its previous row if it is being redefined
+    row = alias_row(alias, dataset_id, layer_id, agg_fun, m)
+    previous_row = m.alias_rows.get(alias)
+    if previous_row is None:
+        m.added_variables_output.children += (row,)
+    else:
+        m.added_variables_output.children = tuple(
+            row if child is previous_row else child
+            for child in m.added_variables_output.children
+        )
+        previous_row.close()
+    m.alias_rows[alias] = row
+
+    # Add the alias to the map as a thread
+    async_add_alias(ds, alias, m)
 
 
 def add_alias(
@@ -276,7 +456,6 @@ def add_alias(
     start_date=None,
     end_date=None,
     agg_fun=None,
-    list_aliases=False,
 ):
     """
     Adds the selected layer as an alias to the map and updates the UI.
@@ -290,7 +469,6 @@ def add_alias(
         start_date (datetime, optional): Start date for filtering. Defaults to None.
         end_date (datetime, optional): End date for filtering. Defaults to None.
         agg_fun (str, optional): Aggregation function. Defaults to None.
-        list_aliases (bool, optional): Whether to list aliases after adding. Defaults to False.
 
     Returns:
         None
@@ -300,119 +478,74 @@ def add_alias(
     dataset_id = m.custom_product_input.value if dataset is None else dataset
     layer_id = m.band_dropdown.value if layer is None else layer
 
-    # If the alias is empty, we will set it to be `{dataset}:{layer}`
+    # Get the aggregation function
+    agg_fun = m.agg_fun_dropdown.value if agg_fun is None else agg_fun
+
+    # If the alias is empty, we will name it after the band and aggregation function
     alias = m.layer_alias_input.value if alias_name is None else alias_name
     if not alias:
-        alias = f"{agg_fun}({layer_id})" if agg_fun != "NONE" else layer_id
+        alias = default_alias(layer_id, agg_fun)
 
     # If the dataset or layer is empty, we will not add the alias
     if not dataset_id or not layer_id:
-        message(m, "Please select a dataset and layer.", False)
-        message(m, "Please select a dataset and layer.", True)
+        flash(m, "Please select a dataset and layer.")
         return
 
-    # Get the aggregation function
-    agg_fun = m.agg_fun_dropdown.value if agg_fun is None else agg_fun
-
     try:
 
         # Get the start and end dates and format them for querying
         start_date = (m.start if start_date is None else start_date).isoformat()
         end_date = (m.end if end_date is None else end_date).isoformat()
 
-        # Set the region of interest
-        qr_roi = m.qr if not m.roi else m.qr.union(m.roi)
-
-        # An attempt to grab an early win if the agg_fun is `LAST` and the user wants an image instead of a collection
-        ds = None
-        if agg_fun == "LAST":
-            img = ee.Image(dataset_id).select(layer_id)
-            if check_image_validity(img):
-                ds = img
-
-        # If the user does not want an image, we simply load the collection.
-        if not ds:
-            ds = ee.ImageCollection(dataset_id).select(layer_id)
-            ds = ds.filterDate(start_date, end_date)
-            ds = ds.filterBounds(qr_roi)
-            if not ds.size().getInfo():
-                message(
-                    m,
-                    "No data available for the selected region and time period.",
-                    False,
-                )
-                message(
-                    m,
-                    "No data available for the selected region and time period.",
-                    True,
-                )
-                m.layer_alias_input.value = ""
-                return
+        # Build the alias image and register it
+        args = (alias, dataset_id, layer_id, agg_fun, start_date, end_date)
+        register_alias(m, *args, build_alias_image(m, *args))
 
-        # Only do this if `ds` is a collection
-        if isinstance(ds, ee.ImageCollection):
-            if agg_fun == "LAST":
-                ds = ds.sort("system:time_start", False).first()
-            elif agg_fun == "FIRST":
-                ds = ds.first()
-            elif agg_fun == "MAX":
-                ds = ds.max()
-            elif agg_fun == "MIN":
-                ds = ds.min()
-            elif agg_fun == "MEAN":
-                ds = ds.mean()
-            elif agg_fun == "MEDIAN":
-                ds = ds.median()
-            elif agg_fun == "SUM":
-                ds = ds.sum()
-            elif agg_fun == "MODE":
-                ds = ds.mode()
-            else:
-                message(m, f"aggregation function {agg_fun} is invalid", False)
-                message(m, f"aggregation function {agg_fun} is invalid", True)
-                return
-
-        # Clip the image to the query region
-        ds = ds.clip(qr_roi)
-
-        # Rename the band to the alias
-        ds = ds.rename(alias)
-
-        # Add the alias to the dictionary
-        m.aliases[alias] = [dataset_id, layer_id, agg_fun, start_date, end_date, ds]
-
-        # Clear the output widget and print the added variables
-        if list_aliases:
-            with m.added_variables_output:
-                m.added_variables_output.clear_output()
-                for alias_, (dataset, layer, agg_fun, _, _, _) in m.aliases.items():
-                    remove_button = widgets.Button(
-                        description="x",
-                        layout=widgets.Layout(
-                            width="20px", text_align="center", padding="0"
-                        ),
-                    )
-                    spacer = widgets.HBox([], layout=widgets.Layout(flex="1 1 auto"))
-                    remove_button.on_click(lambda _, a=alias_: remove_alias(a, m))
-                    display(
-                        widgets.HBox(
-                            [
-                                widgets.Label(
-                                    f"{alias_}: {dataset.split('/')[-1]}:{layer}:{agg_fun}"
-                                ),
-                                spacer,
-                                remove_button,
-                            ],
-                            layout=widgets.Layout(width="100%"),
-                        )
-                    )
-
-        # Empty the alias field
-        m.layer_alias_input.value = ""
-
-        # Add the alias to the map as a thread
-        async_add_alias(ds, alias, m)
+    except ValueError as e:
+        flash(m, str(e))
 
     except Exception as e:
-        message(m, f"Error: {e}.", False)
-        message(m, f"Error: {e}.", True, 10)
+        flash(m, f"Error: {e}.", 10)
+
+    # Empty the alias field
+    m.layer_alias_input.value = ""
+
+
+def add_aliases(m, aliases):
+    """
+    Adds several aliases to the map, building their images concurrently.
+
+    Building an alias mostly waits on Earth Engine, so the images are built on the shared
+    thread pool. They are then registered, and their errors reported, from the
+    calling thread in the given order, so the listed aliases keep the order of the
+    specification.
+
+    Args:
+        m (object): Map object containing various attributes and methods.
+        aliases (list): Tuples of `(alias, dataset, layer, start_date, end_date, agg_fun)`.
+
+    Returns:
+        None
+    """
+
+    def build(alias, dataset_id, layer_id, start_date, end_date, agg_fun):
+        alias = alias or default_alias(layer_id, agg_fun)
+        args = (alias, dataset_id, layer_id, agg_fun)
+        args += (start_date.isoformat(), end_date.isoformat())
+        try:
+            return args, build_alias_image(m, *args), None
+        except ValueError as e:
+            return args, None, str(e)
+        except Exception as e:
+            return args, None, f"Error: {e}."
+
+    if not aliases:
+        return
+
+    built = list(executor.map(lambda alias: build(*alias), aliases))
+
+    for args, ds, error in built:
+        if error is None:
+            register_alias(m, *args, ds)
+        else:
+            flash(m, error, 10)
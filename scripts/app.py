@@ -6,8 +6,12 @@ Main application for the Similarity Search Tool.
 This script creates the main Map objects and adds custom GUI widgets to it to enable similarity search and clustering use cases.
 """
 
+import bisect
+import functools
 import os
-import yaml
+import re
+import threading
+from collections import OrderedDict, deque
 from datetime import date
 from dotenv import load_dotenv
 
@@ -24,6 +28,7 @@ import solara
 from IPython.core.display import display
 
 from region_similarity.map import (
+    BASEMAP_PATTERN,
     reset_map,
     update_mask_dropdown,
     update_distance_dropdown,
@@ -37,29 +42,119 @@ from region_similarity.regions import (
 )
 from region_similarity.periods import update_end_date, update_start_date
 from region_similarity.features import add_feature
-from region_similarity.variables import add_alias, update_custom_product
-from region_similarity.search import execute, handle_interaction
+from region_similarity.variables import AGGREGATIONS, add_alias, update_custom_product
+from region_similarity.search import (
+    DISTANCE_FNS,
+    LANDCOVER_CLASSES,
+    execute,
+    handle_interaction,
+)
 from region_similarity.export import export_image
-from region_similarity.helpers import message, update_map
-from region_similarity.use_cases import import_spec, export_spec
+from region_similarity.helpers import MapCaches, debounce, executor, flash, update_map
+from region_similarity.use_cases import import_spec_file, export_spec
 
 # Define host
 hostname = os.environ.get("HOST")
 
-# Get authentication credentials
-google_credentials = os.environ.get("GOOGLE_APPLICATION_CREDENTIALS")
+# Options of the dropdowns, shared by the maps of every session
+AGGREGATION_OPTIONS = tuple(AGGREGATIONS)
+MASK_OPTIONS = ("All",) + LANDCOVER_CLASSES
+DISTANCE_OPTIONS = tuple(DISTANCE_FNS)
+
+# Whether Earth Engine was initialized, which happens when the first map is created
+ee_initialized = False
+ee_initialized_lock = threading.Lock()
+
+
+def initialize_ee():
+    """
+    Authenticates to Earth Engine with the GCP service account credentials, once per process.
+
+    Raises:
+        ValueError: If the `GOOGLE_APPLICATION_CREDENTIALS` environment variable is not set.
+        Exception: If Earth Engine could not be initialized with the credentials.
+    """
+    global ee_initialized
+    with ee_initialized_lock:
+        if ee_initialized:
+            return
+
+        # Get authentication credentials
+        google_credentials = os.environ.get("GOOGLE_APPLICATION_CREDENTIALS")
+
+        # Authenticate to Earth Engine using GCP project-based authentication
+        if not google_credentials:
+            raise ValueError(
+                "GCP project-based authentication requires both GOOGLE_APPLICATION_CREDENTIALS environment variables to be set"
+            )
+
+        try:
+            credentials = ee.ServiceAccountCredentials("", google_credentials)
+            ee.Initialize(
+                credentials, opt_url="https://earthengine-highvolume.googleapis.com"
+            )
+        except Exception as e:
+            raise Exception(
+                f"Failed to authenticate with GCP project credentials: {str(e)}"
+            )
+        ee_initialized = True
+
+
+# Geocoded locations by normalized query, evicting the least recently used ones
+geocode_cache = OrderedDict()
+GEOCODE_CACHE_SIZE = 1024
+
+
+def geocode_location(query):
+    """
+    Geocodes a location query, reusing the locations of previous searches.
+
+    Queries are normalized by stripping and lowercasing them. Searches without a result
+    are not cached, so they are retried on the next submit.
+
+    Args:
+        query (str): The place name or address to search for.
 
-# Authenticate to Earth Engine using GCP project-based authentication
-if not google_credentials:
-    raise ValueError(
-        "GCP project-based authentication requires both GOOGLE_APPLICATION_CREDENTIALS environment variables to be set"
+    Returns:
+        tuple: The `(lat, lon)` of the first result and its Earth Engine point, or None
+        if no location was found.
+    """
+    key = query.strip().lower()
+    if key in geocode_cache:
+        geocode_cache.move_to_end(key)
+        return geocode_cache[key]
+
+    results = geocode(query)
+    if not results:
+        return None
+
+    # Earth Engine geometries are immutable, so the point is shared by every hit
+    location = (
+        (results[0].lat, results[0].lng),
+        ee.Geometry.Point(results[0].lng, results[0].lat),
     )
+    geocode_cache[key] = location
+    if len(geocode_cache) > GEOCODE_CACHE_SIZE:
+        geocode_cache.popitem(last=False)
+    return location
 
-try:
-    credentials = ee.ServiceAccountCredentials("", google_credentials)
-    ee.Initialize(credentials, opt_url="https://earthengine-highvolume.googleapis.com")
-except Exception as e:
-    raise Exception(f"Failed to authenticate with GCP project credentials: {str(e)}")
+
+# Styled headers of the search panel sections
+SECTION_HEADER_HTML = """
+            <h3 style="font-family: Arial, sans-serif; color: var(--jp-ui-font-color1); 
+                    padding: 3px 12px; font-weight: bold; background-color: #f7f7f7; 
+                    border-radius: 5px; border: 1px solid #ddd; box-shadow: 1px 1px 3px rgba(0,0,0,0.1);">
+                {title}
+            </h3>
+        """
+LOCATION_HEADER_HTML = SECTION_HEADER_HTML.format(title="Location Search")
+DATA_HEADER_HTML = SECTION_HEADER_HTML.format(title="Data Catalog")
+
+# Closing tags of the dataset descriptions
+ASSET_HTML_SUFFIX = """
+            </body>
+            </html>
+        """
 
 
 def ee_data_html(asset):
@@ -86,55 +181,204 @@ def ee_data_html(asset):
         else:
             coder_url = code_url
 
+        parts = [
+            f"""
+            <html>
+            <body>
+                <h3>{asset_title}</h3>
+                <h4>Dataset Availability</h4>
+                    <p style="margin-left: 40px">{asset_dates}</p>
+                <h4>Earth Engine Identifier</h4>
+                    <p style="margin-left: 40px">{ee_id_snippet}</p>
+            """
+        ]
+
         ## ee datasets always have a asset_url, and should have a thumbnail
-        catalog = (
-            bool(asset_url)
-            * f"""
+        if asset_url:
+            # The catalog pages of a dataset only differ by the name of the page
+            base_url, sep, tail = asset_url.rpartition("terms-of-use")
+            if sep:
+                description_url = f"{base_url}description{tail}"
+                bands_url = f"{base_url}bands{tail}"
+                properties_url = f"{base_url}image-properties{tail}"
+            else:
+                description_url = bands_url = properties_url = asset_url
+            parts.append(
+                f"""
                     <h4>Data Catalog</h4>
-                        <p style="margin-left: 40px; margin-bottom: 0px !important;"><a href="{asset_url.replace('terms-of-use','description')}" target="_blank">Description</a></p>
-                        <p style="margin-left: 40px; margin-bottom: 0px !important;"><a href="{asset_url.replace('terms-of-use','bands')}" target="_blank">Bands</a></p>
-                        <p style="margin-left: 40px; margin-bottom: 0px !important;"><a href="{asset_url.replace('terms-of-use','image-properties')}" target="_blank">Properties</a></p>
+                        <p style="margin-left: 40px; margin-bottom: 0px !important;"><a href="{description_url}" target="_blank">Description</a></p>
+                        <p style="margin-left: 40px; margin-bottom: 0px !important;"><a href="{bands_url}" target="_blank">Bands</a></p>
+                        <p style="margin-left: 40px; margin-bottom: 0px !important;"><a href="{properties_url}" target="_blank">Properties</a></p>
                         <p style="margin-left: 40px"><a href="{coder_url}" target="_blank">Example</a></p>
                     """
-        )
-        thumbnail = (
-            bool(thumbnail_url)
-            * f"""
-                    <h4>Dataset Thumbnail</h4>
-                    <img src="{thumbnail_url}">
-                    """
-        )
+            )
+
         ## only community datasets have a code_url
-        alternative = (
-            bool(code_url)
-            * f"""
+        if code_url:
+            parts.append(
+                f"""
                     <h4>Community Catalog</h4>
                         <p style="margin-left: 40px; margin-bottom: 0px !important;">{asset.get('provider','Provider unknown')}</p>
                         <p style="margin-left: 40px; margin-bottom: 0px !important;">{asset.get('tags','Tags unknown')}</p>
                         <p style="margin-left: 40px; margin-bottom: 0px !important;"><a href="{coder_url}" target="_blank">Example</a></p>
                     """
-        )
+            )
 
-        template = f"""
-            <html>
-            <body>
-                <h3>{asset_title}</h3>
-                <h4>Dataset Availability</h4>
-                    <p style="margin-left: 40px">{asset_dates}</p>
-                <h4>Earth Engine Identifier</h4>
-                    <p style="margin-left: 40px">{ee_id_snippet}</p>
-                {catalog}
-                {alternative}
-                {thumbnail}
-            </body>
-            </html>
-        """
-        return template
+        if thumbnail_url:
+            parts.append(
+                f"""
+                    <h4>Dataset Thumbnail</h4>
+                    <img src="{thumbnail_url}">
+                    """
+            )
+
+        parts.append(ASSET_HTML_SUFFIX)
+        return "".join(parts)
 
     except Exception as e:
         print(e)
 
 
+# Rendered dataset descriptions by Earth Engine ID
+asset_html_cache = dict()
+
+
+def cached_ee_data_html(asset):
+    """
+    Generates the HTML of an asset, reusing it when the asset is displayed again.
+
+    Args:
+        asset (dict): A dictionary containing an Earth Engine asset.
+
+    Returns:
+        str: A string containing HTML.
+    """
+    asset_id = asset.get("id")
+    html = asset_html_cache.get(asset_id)
+    if html is None:
+        html = ee_data_html(asset)
+        if html is not None:
+            asset_html_cache[asset_id] = html
+    return html
+
+
+@functools.lru_cache(maxsize=256)
+def cached_search_ee_data(query):
+    """
+    Searches the Earth Engine data catalogs, reusing the results of previous searches.
+
+    Args:
+        query (str): The normalized keywords to search for.
+
+    Returns:
+        tuple: The matching datasets.
+
+    Raises:
+        RuntimeError: If the data catalogs could not be fetched, which is not cached.
+    """
+    # The search prints its errors and returns None instead of raising them
+    datasets = search_ee_data(query, source="all")
+    if datasets is None:
+        raise RuntimeError("Failed to search the data catalog.")
+    return tuple(datasets)
+
+
+# Sorted `(word, dataset index)` pairs over the whole catalog, built in the background
+catalog_index = None
+catalog_index_lock = threading.Lock()
+CATALOG_KEYS = ("id", "provider", "tags", "title")
+
+# Longest query answered by the catalog index alone when it has hits. Other queries also
+# run the keyword search, whose substring matches the word prefixes of the index miss.
+PREFIX_QUERY_LENGTH = 3
+
+
+def build_catalog_index():
+    """
+    Builds the word index of the Earth Engine data catalogs.
+
+    Every dataset is indexed by the lowercase words of its ID, provider, tags and title.
+
+    Returns:
+        tuple: The sorted words, the dataset index of each word and the datasets.
+    """
+    datasets = cached_search_ee_data("")
+    pairs = sorted(
+        {
+            (word, i)
+            for i, dataset in enumerate(datasets)
+            for key in CATALOG_KEYS
+            for word in re.findall(r"\w+", str(dataset.get(key, "")).lower())
+        }
+    )
+    return [word for word, _ in pairs], [i for _, i in pairs], datasets
+
+
+def get_catalog_index():
+    """
+    Get the word index of the Earth Engine data catalogs, without waiting for it.
+
+    The first call starts building the index on the shared thread pool. A failed build
+    is started again by the next call.
+
+    Returns:
+        tuple: The sorted words, the dataset index of each word and the datasets, or None
+            if the index is not built yet.
+    """
+    global catalog_index
+    with catalog_index_lock:
+        if catalog_index is None or (
+            catalog_index.done() and catalog_index.exception() is not None
+        ):
+            catalog_index = executor.submit(build_catalog_index)
+        future = catalog_index
+    return future.result() if future.done() else None
+
+
+def search_catalog_index(query):
+    """
+    Searches the data catalogs locally for the datasets having a word starting with
+    every word of the query.
+
+    Args:
+        query (str): The normalized keywords to search for.
+
+    Returns:
+        tuple: The matching datasets, in catalog order, or None if the index is not
+            built yet or the query has no words.
+    """
+    tokens = re.findall(r"\w+", query)
+    index = get_catalog_index()
+    if index is None or not tokens:
+        return None
+    words, ids, datasets = index
+    matches = None
+    for token in tokens:
+        start = bisect.bisect_left(words, token)
+        end = bisect.bisect_left(words, token + "\uffff", start)
+        found = set(ids[start:end])
+        matches = found if matches is None else matches & found
+        if not matches:
+            return tuple()
+    return tuple(datasets[i] for i in sorted(matches))
+
+
+def merge_datasets(first, second):
+    """
+    Merges two lists of datasets, dropping the datasets of the second one already listed
+    by the first one.
+
+    Args:
+        first (tuple): The datasets listed first.
+        second (tuple): The datasets listed after them.
+
+    Returns:
+        tuple: The merged datasets.
+    """
+    ids = {dataset["id"] for dataset in first}
+    return tuple(first) + tuple(x for x in second if x["id"] not in ids)
+
+
 @map_widgets.Theme.apply
 class SearchGEEDataGUI(widgets.VBox):
     """
@@ -152,21 +396,16 @@ class SearchGEEDataGUI(widgets.VBox):
             m: The map object to which this GUI is attached.
             **kwargs: Additional keyword arguments for the VBox.
         """
+        # Start indexing the data catalogs before the first search
+        get_catalog_index()
+
         # Initialize for both location and data search
         m.search_datasets = None
         m.search_loc_marker = None
         m.search_loc_geom = None
 
         # Location Search Header (similar to Data Catalog header)
-        location_header = widgets.HTML(
-            value="""
-            <h3 style="font-family: Arial, sans-serif; color: var(--jp-ui-font-color1); 
-                    padding: 3px 12px; font-weight: bold; background-color: #f7f7f7; 
-                    border-radius: 5px; border: 1px solid #ddd; box-shadow: 1px 1px 3px rgba(0,0,0,0.1);">
-                Location Search
-            </h3>
-        """
-        )
+        location_header = widgets.HTML(value=LOCATION_HEADER_HTML)
 
         # Search location box
         search_location_box = widgets.Text(
@@ -175,25 +414,24 @@ class SearchGEEDataGUI(widgets.VBox):
             layout=widgets.Layout(width="400px"),
         )
 
+        @debounce(0.2)
         def search_location_callback(text):
             if text.value != "":
-                g = geocode(text.value)
-                if g:
+                m.geocode_seq += 1
+                seq = m.geocode_seq
+                location = geocode_location(text.value)
+                # Only the latest search moves the map
+                if seq != m.geocode_seq:
+                    return
+                if location:
                     # If a location is found, center the map and zoom in
-                    latlon = (g[0].lat, g[0].lng)
-                    m.search_loc_geom = ee.Geometry.Point(g[0].lng, g[0].lat)
+                    latlon, m.search_loc_geom = location
                     m.center = latlon
                     m.zoom = 12
                     text.value = ""
                 else:
                     # If no location was found, send a message to the user
-                    message(m, text="No location found. Please try again.", clear=False)
-                    message(
-                        m,
-                        text="No location found. Please try again.",
-                        clear=True,
-                        duration=1,
-                    )
+                    flash(m, "No location found. Please try again.", 1)
 
         search_location_box.on_submit(search_location_callback)
 
@@ -237,41 +475,71 @@ class SearchGEEDataGUI(widgets.VBox):
 
         html_widget = widgets.HTML()
 
+        # Latest status lines of the catalog search, displayed in place of the results
+        status_lines = deque(maxlen=20)
+        status_widget = widgets.HTML()
+
+        def show_status(text):
+            status_lines.append(text)
+            status_widget.value = "<br>".join(status_lines)
+            with search_data_output:
+                search_data_output.clear_output(wait=True)
+                display(status_widget)
+
+        def show_html():
+            status_lines.clear()
+            with search_data_output:
+                search_data_output.clear_output()
+                display(html_widget)
+
         def dropdown_change(change):
             dropdown_index = assets_dropdown.index
             if dropdown_index is not None and dropdown_index >= 0:
-                search_data_output.append_stdout("Loading ...")
                 datasets = m.search_datasets
                 dataset = datasets[dropdown_index]
-                dataset_html = ee_data_html(dataset)  # Assuming ee_data_html is defined
+                dataset_html = cached_ee_data_html(dataset)
+                # Skip redrawing a description that is already displayed
+                if dataset_html == html_widget.value:
+                    return
                 html_widget.value = dataset_html
-                with search_data_output:
-                    search_data_output.clear_output()
-                    display(html_widget)
+                show_html()
 
         assets_dropdown.observe(dropdown_change, names="value")
 
+        @debounce(0.2)
         def search_data_callback(text):
             if text.value != "":
-                with search_data_output:
-                    print("Searching data catalog ...")
+                m.catalog_seq += 1
+                seq = m.catalog_seq
+                show_status("Searching data catalog ...")
                 m.default_style = {"cursor": "wait"}
-                ee_assets = search_ee_data(
-                    text.value, source="all"
-                )  # Assuming search_ee_data is defined
+                query = text.value.strip().lower()
+                ee_assets = search_catalog_index(query)
+                # Short prefixes with hits are answered by the index alone, otherwise
+                # the keyword search adds the datasets the index did not find
+                try:
+                    if not ee_assets or len(query) > PREFIX_QUERY_LENGTH:
+                        ee_assets = merge_datasets(
+                            ee_assets or (), cached_search_ee_data(query)
+                        )
+                except RuntimeError as e:
+                    if seq == m.catalog_seq:
+                        show_status(f"{e} Please try again.")
+                        m.default_style = {"cursor": "default"}
+                    return
+                # Only the latest search fills the dropdown
+                if seq != m.catalog_seq:
+                    return
                 m.search_datasets = ee_assets
-                asset_titles = [x["title"] for x in ee_assets]
-                assets_dropdown.options = asset_titles
-                if len(ee_assets) > 0:
-                    assets_dropdown.index = 0
-                    html_widget.value = ee_data_html(
-                        ee_assets[0]
-                    )  # Assuming ee_data_html is defined
-                else:
-                    html_widget.value = "No results found."
-                with search_data_output:
-                    search_data_output.clear_output()
-                    display(html_widget)
+                # Send the dropdown and the description to the frontend together
+                with assets_dropdown.hold_sync(), html_widget.hold_sync():
+                    assets_dropdown.options = tuple(x["title"] for x in ee_assets)
+                    if len(ee_assets) > 0:
+                        assets_dropdown.index = 0
+                        html_widget.value = cached_ee_data_html(ee_assets[0])
+                    else:
+                        html_widget.value = "No results found."
+                show_html()
                 m.default_style = {"cursor": "default"}
             else:
                 search_data_output.clear_output()
@@ -281,15 +549,7 @@ class SearchGEEDataGUI(widgets.VBox):
         assets_combo = widgets.HBox([import_btn, assets_dropdown])
 
         # Data Catalog Header
-        data_header = widgets.HTML(
-            value="""
-            <h3 style="font-family: Arial, sans-serif; color: var(--jp-ui-font-color1); 
-                    padding: 3px 12px; font-weight: bold; background-color: #f7f7f7; 
-                    border-radius: 5px; border: 1px solid #ddd; box-shadow: 1px 1px 3px rgba(0,0,0,0.1);">
-                Data Catalog
-            </h3>
-        """
-        )
+        data_header = widgets.HTML(value=DATA_HEADER_HTML)
 
         # Stack the search location and search data catalog widgets
         location_search = widgets.VBox([location_header, search_location_box])
@@ -319,6 +579,8 @@ class Map(geemap.Map):
         Args:
             **kwargs: Additional keyword arguments for geemap.Map.
         """
+        # Initialize Earth Engine before geemap tries to do it on its own
+        initialize_ee()
         super().__init__(**kwargs)
         self.initialize_map()
         self.create_widgets()
@@ -329,19 +591,29 @@ class Map(geemap.Map):
     def initialize_map(self):
         """Initialize map properties and clear existing layers."""
         self.url = hostname
-        self.clear_layers()
+        # A fresh map only holds its default basemap, which `clear_layers` keeps anyway
+        if len(self.layers) > 1:
+            self.clear_layers()
         self.qr_set = False
         self.roi_set = False
         self.distances = None
+        self.click_seq = 0
+        self.geocode_seq = 0
+        self.catalog_seq = 0
         self.start = date(2000, 1, 1)
         self.end = date(2000, 1, 1)
         self.aliases = dict()
+        self.alias_rows = dict()
         self.features = dict()
+        self.feature_rows = dict()
+        self.caches = MapCaches()
         self.mask = "All"
         self.distance_fun = "Euclidean"
         self.cluster = False
         self.roi = None
+        self.roi_coords = None
         self.qr = None
+        self.qr_coords = None
 
     def create_widgets(self):
         """Create and configure all widgets used in the map interface."""
@@ -352,7 +624,7 @@ class Map(geemap.Map):
             layout=widgets.Layout(width="100%", height="30px"),
             tooltip="Clear the map and start a new analysis session.",
         )
-        self.reset_button.on_click(lambda event: reset_map(event, self))
+        self.reset_button.on_click(functools.partial(reset_map, m=self))
 
         self.spec_export_button = widgets.Button(
             description="Export Session",
@@ -360,7 +632,7 @@ class Map(geemap.Map):
             layout=widgets.Layout(width="100%", height="30px"),
         )
 
-        self.spec_export_button.on_click(lambda event: export_spec(event, self))
+        self.spec_export_button.on_click(functools.partial(export_spec, m=self))
 
         self.spec_import_button = widgets.FileUpload(
             description="Import Session",
@@ -373,16 +645,7 @@ class Map(geemap.Map):
         def handle_spec_upload(change):
             if not change["new"]:
                 return
-            content = change["new"][0]["content"]
-            try:
-                spec_data = yaml.safe_load(content.decode("utf-8"))
-                import_spec(self, spec_data)
-            except yaml.YAMLError as e:
-                message(self, f"Error parsing YAML file: {str(e)}", False)
-                message(self, f"Error parsing YAML file: {str(e)}", True)
-            except Exception as e:
-                message(self, f"Error importing specification: {str(e)}", False)
-                message(self, f"Error importing specification: {str(e)}", True)
+            import_spec_file(self, change["new"][0]["content"])
 
         self.spec_import_button.observe(handle_spec_upload, names="value")
 
@@ -391,7 +654,7 @@ class Map(geemap.Map):
             layout=widgets.Layout(height="30px"),
             tooltip="Click on the map to select a search region. Once done, click here.",
         )
-        self.set_region_button.on_click(lambda event: set_search_region(event, self))
+        self.set_region_button.on_click(functools.partial(set_search_region, m=self))
         self.ros_upload_button = widgets.FileUpload(
             description="Upload",
             accept=".geojson,.gpkg,.zip",
@@ -400,7 +663,7 @@ class Map(geemap.Map):
             layout=widgets.Layout(height="30px", width="27%"),
         )
         self.ros_upload_button.observe(
-            lambda event: handle_upload_change(event, self), names="value"
+            functools.partial(handle_upload_change, m=self), names="value"
         )
 
         self.cluster_checkbox = widgets.Checkbox(
@@ -411,7 +674,7 @@ class Map(geemap.Map):
             tooltip="When checked, the search region will be clustered into groups of similar pixels.",
         )
         self.cluster_checkbox.observe(
-            lambda event: handle_clustering_change(event, self), names="value"
+            functools.partial(handle_clustering_change, m=self), names="value"
         )
         self.num_clusters = widgets.BoundedIntText(
             value=3,
@@ -429,7 +692,7 @@ class Map(geemap.Map):
             layout=widgets.Layout(height="30px"),
             tooltip="Use the 'Draw Polygon' tool on the left to draw before clicking here.",
         )
-        self.set_roi_button.on_click(lambda event: set_region_of_interest(event, self))
+        self.set_roi_button.on_click(functools.partial(set_region_of_interest, m=self))
         self.roi_upload_button = widgets.FileUpload(
             description="Upload",
             accept=".geojson,.gpkg,.zip",
@@ -438,7 +701,7 @@ class Map(geemap.Map):
             layout=widgets.Layout(height="30px", width="27%"),
         )
         self.roi_upload_button.observe(
-            lambda event: handle_roi_upload_change(event, self), names="value"
+            functools.partial(handle_roi_upload_change, m=self), names="value"
         )
         self.start_date = widgets.DatePicker(
             description="Start Date:",
@@ -446,28 +709,28 @@ class Map(geemap.Map):
             tooltip="Start date for the period of interest.",
         )
         self.start_date.observe(
-            lambda event: update_start_date(event, self), names="value"
+            functools.partial(update_start_date, m=self), names="value"
         )
         self.end_date = widgets.DatePicker(
             description="End Date:",
             value=date(2000, 1, 1),
             tooltip="End date for the period of interest.",
         )
-        self.end_date.observe(lambda event: update_end_date(event, self), names="value")
+        self.end_date.observe(functools.partial(update_end_date, m=self), names="value")
         self.custom_product_input = widgets.Text(
             description="Data ID:",
             placeholder="e.g. `COPERNICUS/S2_SR_HARMONIZED`",
             tooltip="Identifier of the Google Earth Engine dataset to use (search in the top left).",
         )
         self.custom_product_input.observe(
-            lambda event: update_custom_product(event, self), names="value"
+            functools.partial(update_custom_product, m=self), names="value"
         )
         self.band_dropdown = widgets.Dropdown(
             description="Band:",
             placeholder="B4",
         )
         self.agg_fun_dropdown = widgets.Dropdown(
-            options=["LAST", "FIRST", "MAX", "MIN", "MEAN", "MEDIAN", "SUM", "MODE"],
+            options=AGGREGATION_OPTIONS,
             description="Aggregation:",
             tooltip="Select the aggregation function to apply to the data.",
         )
@@ -481,12 +744,10 @@ class Map(geemap.Map):
             layout=widgets.Layout(width="100%"),
             tooltip="Add the selected variable to the list of aliases.",
         )
-        self.added_variables_output = widgets.Output(
+        self.added_variables_output = widgets.VBox(
             layout=widgets.Layout(width="100%")
         )
-        self.add_button.on_click(
-            lambda event: add_alias(event, self, list_aliases=True)
-        )
+        self.add_button.on_click(functools.partial(add_alias, m=self))
         self.udf = widgets.Text(
             description="Expression:",
             tooltip="Enter a custom expression to apply.",
@@ -497,26 +758,15 @@ class Map(geemap.Map):
             layout=widgets.Layout(width="100%"),
             tooltip="Add the custom feature to the list of features.",
         )
-        self.added_features_output = widgets.Output(layout=widgets.Layout(width="100%"))
-        self.add_feature.on_click(lambda event: add_feature(event, self))
+        self.added_features_output = widgets.VBox(layout=widgets.Layout(width="100%"))
+        self.add_feature.on_click(functools.partial(add_feature, m=self))
         self.mask_dropdown = widgets.Dropdown(
-            options=[
-                "All",
-                "water",
-                "trees",
-                "grass",
-                "flooded_vegetation",
-                "crops",
-                "shrub_and_scrub",
-                "built",
-                "bare",
-                "snow_and_ice",
-            ],
+            options=MASK_OPTIONS,
             description="Land cover:",
             tooltip="Select the land cover mask to apply to the data.",
         )
         self.mask_dropdown.observe(
-            lambda event: update_mask_dropdown(event, self), names="value"
+            functools.partial(update_mask_dropdown, m=self), names="value"
         )
         self.max_value_slider = widgets.FloatSlider(
             value=3.3,
@@ -531,12 +781,12 @@ class Map(geemap.Map):
             lambda event: update_map(event, self), names="value"
         )
         self.distance_dropdown = widgets.Dropdown(
-            options=["Euclidean", "Manhattan", "Cosine"],
+            options=DISTANCE_OPTIONS,
             description="Distance:",
             tooltip="Distance function to use for similarity search or clustering.",
         )
         self.distance_dropdown.observe(
-            lambda event: update_distance_dropdown(event, self), names="value"
+            functools.partial(update_distance_dropdown, m=self), names="value"
         )
         self.search_button = widgets.Button(
             description="Search!",
@@ -545,59 +795,67 @@ class Map(geemap.Map):
         )
         self.search_button.style.font_weight = "bold"
         self.search_button.style.font_size = "16px"
-        self.search_button.on_click(lambda event: execute(event, self))
+        self.search_button.on_click(functools.partial(execute, m=self))
         self.export_button = widgets.Button(
             description="Download",
             layout=widgets.Layout(width="100%"),
             tooltip="Download the generated map and features.",
         )
-        self.export_button.on_click(lambda event: export_image(event, self))
+        self.export_button.on_click(functools.partial(export_image, m=self))
+        self.download_bar = widgets.IntProgress(
+            value=0,
+            min=0,
+            max=1,
+            layout=widgets.Layout(width="100%", height="0px", visibility="hidden"),
+        )
 
         # Accordion Sections
-        set_periods = widgets.VBox([self.start_date, self.end_date])
-        set_regions = widgets.VBox(
-            [
-                widgets.HBox(
-                    [
-                        widgets.HTML("Search Region:"),
-                        self.ros_upload_button,
-                        self.set_region_button,
-                    ]
-                ),
-                widgets.HBox([self.cluster_checkbox, self.num_clusters]),
-                widgets.HBox(
-                    [
-                        widgets.HTML("Control Region:"),
-                        self.roi_upload_button,
-                        self.set_roi_button,
-                    ]
-                ),
-            ]
-        )
-        set_aliases = widgets.VBox(
-            [
-                self.custom_product_input,
-                self.band_dropdown,
-                self.agg_fun_dropdown,
-                self.layer_alias_input,
-                self.add_button,
-                self.added_variables_output,
-            ]
-        )
-        set_features = widgets.VBox(
-            [self.udf, self.add_feature, self.added_features_output]
-        )
-        optional = widgets.VBox([self.mask_dropdown, self.distance_dropdown])
-
-        self.accordion = widgets.Accordion(
-            children=[
-                set_regions,
-                set_periods,
-                set_aliases,
-                set_features,
-                optional,
-            ]
-        )
+        set_regions = [
+            widgets.HBox(
+                [
+                    widgets.HTML("Search Region:"),
+                    self.ros_upload_button,
+                    self.set_region_button,
+                ]
+            ),
+            widgets.HBox([self.cluster_checkbox, self.num_clusters]),
+            widgets.HBox(
+                [
+                    widgets.HTML("Control Region:"),
+                    self.roi_upload_button,
+                    self.set_roi_button,
+                ]
+            ),
+        ]
+        set_periods = [self.start_date, self.end_date]
+        set_aliases = [
+            self.custom_product_input,
+            self.band_dropdown,
+            self.agg_fun_dropdown,
+            self.layer_alias_input,
+            self.add_button,
+            self.added_variables_output,
+        ]
+        set_features = [self.udf, self.add_feature, self.added_features_output]
+        optional = [self.mask_dropdown, self.distance_dropdown]
+
+        # Only the first section is displayed up front, the others are filled the
+        # first time they are opened so their widgets are not rendered beforehand
+        pages = [widgets.VBox(set_regions)] + [widgets.VBox() for _ in range(4)]
+        pending_sections = {
+            1: set_periods,
+            2: set_aliases,
+            3: set_features,
+            4: optional,
+        }
+
+        def open_section(change):
+            children = pending_sections.pop(change["new"], None)
+            if children is not None:
+                pages[change["new"]].children = children
+
+        self.accordion = widgets.Accordion(children=pages)
+        self.accordion.observe(open_section, names="selected_index")
         self.accordion.set_title(0, "Step 1: Set Regions")
         self.accordion.set_title(1, "Step 2: Set Period")
         self.accordion.set_title(2, "Set Variables")
@@ -612,68 +870,67 @@ class Map(geemap.Map):
     def add_controls(self):
         """Add control widgets to the map."""
 
-        self.output_control = WidgetControl(
-            widget=self.output_widget, position="bottomleft"
-        )
-        self.add_control(self.output_control)
-
-        controls_vbox = widgets.VBox(
-            [
-                self.accordion,
-                self.search_button,
-                self.max_value_slider,
-                self.export_button,
-                self.reset_button,
-                self.spec_export_button,
-                self.spec_import_button,
-            ],
-            layout=widgets.Layout(padding="10px"),
-        )
-
-        self.controls_control = WidgetControl(widget=controls_vbox, position="topright")
-        self.add_control(self.controls_control)
-
-        # Add branding information
-        branding_html = widgets.HTML(
-            value="""
-            <div class="ctl" style="padding: 2px 10px 2px 10px;
-            background: rgba(255, 255, 255, 0.9);
-            box-shadow: 0 0 15px rgba(0, 0, 0, 0.2);
-            border-radius: 5px;
-            text-align: center;">
-                <div class="title">Similarity Search Tool</div>
-                <h3> CGIAR • Microsoft AI4G</h3>
-                <div>
-                    Backend: <a href="https://earthengine.google.com/" target="_blank">GEE</a>.
+        # Send the three controls to the frontend in a single update
+        with self.hold_sync():
+            self.output_control = WidgetControl(
+                widget=self.output_widget, position="bottomleft"
+            )
+            self.add_control(self.output_control)
+
+            controls_vbox = widgets.VBox(
+                [
+                    self.accordion,
+                    self.search_button,
+                    self.max_value_slider,
+                    self.export_button,
+                    self.download_bar,
+                    self.reset_button,
+                    self.spec_export_button,
+                    self.spec_import_button,
+                ],
+                layout=widgets.Layout(padding="10px"),
+            )
+
+            self.controls_control = WidgetControl(
+                widget=controls_vbox, position="topright"
+            )
+            self.add_control(self.controls_control)
+
+            # Add branding information
+            branding_html = widgets.HTML(
+                value="""
+                <div class="ctl" style="padding: 2px 10px 2px 10px;
+                background: rgba(255, 255, 255, 0.9);
+                box-shadow: 0 0 15px rgba(0, 0, 0, 0.2);
+                border-radius: 5px;
+                text-align: center;">
+                    <div class="title">Similarity Search Tool</div>
+                    <h3> CGIAR • Microsoft AI4G</h3>
+                    <div>
+                        Backend: <a href="https://earthengine.google.com/" target="_blank">GEE</a>.
+                    </div>
                 </div>
-            </div>
-            """,
-            layout=widgets.Layout(width="250px"),
-        )
-        self.branding_control = WidgetControl(widget=branding_html, position="topright")
-        self.add_control(self.branding_control)
+                """,
+                layout=widgets.Layout(width="250px"),
+            )
+            self.branding_control = WidgetControl(
+                widget=branding_html, position="topright"
+            )
+            self.add_control(self.branding_control)
 
     def add_layers(self):
         """Add base map layers to the map."""
-        self.add_basemap("OpenStreetMap")
+        # The default basemap of geemap may already be OpenStreetMap
+        if not any(BASEMAP_PATTERN.search(layer.name) for layer in self.layers):
+            self.add_basemap("OpenStreetMap")
 
     def initialize_interaction(self):
         """Set up map interaction handling."""
-        self.on_interaction(lambda **kwargs: handle_interaction(self, **kwargs))
-
-
-@solara.component
-def Page():
-    """
-    Main component for rendering the Similarity Search Tool page.
+        self.on_interaction(functools.partial(handle_interaction, self))
 
-    This function sets up the layout and includes the Map component along with
-    necessary CSS styling.
-    """
 
-    # Added CSS
-    css = widgets.HTML(
-        """
+# Styling of the page, added along with the map
+PAGE_CSS = """
     <style>
         .leaflet-container {
             font-size: 0.85rem !important;
@@ -691,26 +948,43 @@ def Page():
         }
     </style>
     """
-    )
 
-    # Pass the appropriate spec data to the Map component
-    m = Map(
-        height="100%",
-        width="100%",
-        data_ctrl=True,
-        search_ctrl=False,
-        scale_ctrl=False,
-        measure_ctrl=False,
-        fullscreen_ctrl=False,
-        toolbar_ctrl=True,
-        layer_ctrl=True,
-        attribution_ctrl=False,
-        zoom=3,
-        center=(1.6508, 17.7576),
-    )
 
-    layout = widgets.VBox(
-        [css, m],
-        layout=widgets.Layout(width="100%", height="100vh"),
-    )
+@solara.component
+def Page():
+    """
+    Main component for rendering the Similarity Search Tool page.
+
+    This function sets up the layout and includes the Map component along with
+    necessary CSS styling.
+    """
+
+    def create_layout():
+        # Added CSS
+        css = widgets.HTML(PAGE_CSS)
+
+        # Pass the appropriate spec data to the Map component
+        m = Map(
+            height="100%",
+            width="100%",
+            data_ctrl=True,
+            search_ctrl=False,
+            scale_ctrl=False,
+            measure_ctrl=False,
+            fullscreen_ctrl=False,
+            toolbar_ctrl=True,
+            layer_ctrl=True,
+            attribution_ctrl=False,
+            zoom=3,
+            center=(1.6508, 17.7576),
+            prefer_canvas=True,
+        )
+
+        return widgets.VBox(
+            [css, m],
+            layout=widgets.Layout(width="100%", height="100vh"),
+        )
+
+    # Build the map once per session, re-renders of the page reuse it
+    layout = solara.use_memo(create_layout, dependencies=[])
     solara.display(layout)